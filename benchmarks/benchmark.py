@@ -0,0 +1,161 @@
+"""Benchmark commands against the fake backend at growing snapshot counts.
+
+    python benchmarks/benchmark.py --sizes 10 1000
+
+Every command runs once per size with empty catalogs against the fake backend
+of fake.py, a directory tree standing in for btrfs. The run fails when the
+time of a command grows faster than --max-growth times the number of
+snapshots between two sizes, which catches accidentally quadratic code.
+"""
+
+import sys
+from argparse import ArgumentParser, Namespace
+from contextlib import redirect_stdout
+from datetime import UTC, datetime, timedelta
+from importlib import import_module
+from os import devnull
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any
+
+from fake import FakeBackend
+
+import btr_backup.backend
+from btr_backup.common import listings
+
+COMMANDS = ["list", "graph", "check", "snapshot", "upload", "remove"]
+SIZES = [10, 1_000, 10_000, 100_000]
+DIRECTORIES = 10
+
+
+def snapshot_names(count: int) -> list[str]:
+    start = datetime(2020, 1, 1, tzinfo=UTC)
+    return [
+        (start + timedelta(hours=hour)).strftime("%Y-%m-%dT%H:%M:%S%:z")
+        for hour in range(count)
+    ]
+
+
+def make_tree(fake: FakeBackend, root: Path, size: int) -> tuple[Path, Path]:
+    source, destination = root / "source", root / "destination"
+    fake.make_filesystem(source)
+    fake.make_filesystem(destination)
+
+    directories = min(DIRECTORIES, size)
+    names = snapshot_names(size // directories)
+
+    for index in range(directories):
+        directory = source / f"directory-{index:02}"
+        directory.mkdir()
+        (destination / directory.name).mkdir()
+
+        active = directory / "active"
+        fake.create_subvolume(active)
+        (active / "data").write_bytes(bytes(4096))
+
+        for name in names:
+            fake.create_snapshot(active, directory / name, read_only=True)
+
+    return source, destination
+
+
+def command_options(name: str, *args: str) -> dict[str, Any]:
+    parser = ArgumentParser()
+    module = import_module(f"btr_backup.commands.{name}")
+    module.add_arguments(parser)
+    return vars(parser.parse_args(args))
+
+
+def run_command(
+    name: str,
+    source: Path,
+    destination: Path,
+    per_directory: int,
+) -> float:
+    match name:
+        case "upload":
+            # Fake devices are directories, which --dest-dev would reject.
+            options = command_options(name, "--archive-dir", str(destination))
+            options |= {"archive_dir": None, "dest_dev": [destination]}
+        case "remove":
+            options = command_options(name, "--keep-latest", str(per_directory // 2))
+        case _:
+            options = command_options(name)
+
+    # Imported once main installed the fake backend, which the catalog binds.
+    from btr_backup.catalog import catalogs
+
+    catalogs.clear()
+    listings.clear()
+
+    with open(devnull, "w") as output, redirect_stdout(output):
+        start = perf_counter()
+        success = options["func"](source, **options)
+        duration = perf_counter() - start
+
+    if not success:
+        raise RuntimeError(f"Benchmark of {name} failed.")
+
+    return duration
+
+
+def benchmark(args: Namespace, fake: FakeBackend) -> dict[str, dict[int, float]]:
+    results: dict[str, dict[int, float]] = {name: {} for name in args.commands}
+
+    for size in sorted(args.sizes):
+        with TemporaryDirectory(prefix="btr-backup-benchmark-") as root:
+            fake.state = Path(root) / "state"
+            fake.state.mkdir()
+
+            source, destination = make_tree(fake, Path(root), size)
+            per_directory = size // min(DIRECTORIES, size)
+
+            for name in args.commands:
+                duration = run_command(name, source, destination, per_directory)
+                results[name][size] = duration
+                print(
+                    f"{name:<10}{size:>10}{duration:>10.3f} s"
+                    f"{duration / size * 1e6:>12.1f} us/snapshot",
+                    flush=True,
+                )
+
+    return results
+
+
+def regressions(
+    results: dict[str, dict[int, float]],
+    max_growth: float,
+) -> list[str]:
+    found = []
+
+    for name, durations in results.items():
+        sizes = sorted(durations)
+        for smaller, larger in zip(sizes, sizes[1:]):
+            growth = durations[larger] / durations[smaller]
+            if growth > max_growth * larger / smaller:
+                found.append(
+                    f"{name} took {growth:.1f}x longer from {smaller} to {larger} "
+                    f"snapshots"
+                )
+
+    return found
+
+
+def main() -> None:
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--commands", nargs="+", choices=COMMANDS, default=COMMANDS)
+    parser.add_argument("--max-growth", type=float, default=2.0)
+    args = parser.parse_args()
+
+    # Modules bind the backend when imported, so this goes before any command.
+    fake = FakeBackend()
+    btr_backup.backend.backend = fake
+
+    if found := regressions(benchmark(args, fake), args.max_growth):
+        sys.exit("\n".join(["Scaling regressions:", *found]))
+
+
+if __name__ == "__main__":
+    main()
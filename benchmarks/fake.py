@@ -0,0 +1,322 @@
+"""Stand-in backend keeping subvolumes as plain directories.
+
+Subvolume details live in a state directory, named by BTR_BACKUP_FAKE_STATE or
+a new temporary one, keyed by the resolved path of the subvolume so that mount
+points, which are symlinks to the device directory, resolve to the same
+subvolume. Send and receive run this module in a subprocess, like btrfs-progs
+would, and exchange a stream framed like a btrfs send stream.
+
+Only the benchmarks use it, installing it as the backend of the commands.
+"""
+
+import json
+import sys
+import zlib
+from collections.abc import Iterator
+from dataclasses import asdict, dataclass
+from hashlib import sha1
+from os import environ, walk
+from pathlib import Path
+from shutil import copytree, rmtree
+from struct import Struct
+from subprocess import DEVNULL, PIPE, Popen
+from tempfile import mkdtemp
+from typing import BinaryIO
+from uuid import uuid4
+
+from btr_backup.archive import (
+    ATTRIBUTE_SIZE,
+    COMMAND_HEADER,
+    END,
+    SNAPSHOT,
+    STREAM_HEADER,
+    STREAM_MAGIC,
+    SUBVOL,
+    UPDATE_EXTENT,
+    WRITE,
+)
+from btr_backup.stream import write_all
+
+STATE_VARIABLE = "BTR_BACKUP_FAKE_STATE"
+
+NULL_UUID = bytes(16)
+WRITE_SIZE = 48 * 1024
+
+# Update extents carry their length in a real btrfs size attribute.
+SIZE_ATTRIBUTE = Struct("<HHQ")
+
+
+@dataclass
+class FakeSubvolumeInfo:
+    id: int
+    uuid: bytes
+    received_uuid: bytes
+    parent_uuid: bytes
+    generation: int
+    read_only: bool
+
+
+class FakeBackend:
+    def __init__(self, state: Path | None = None) -> None:
+        if state is None and STATE_VARIABLE in environ:
+            state = Path(environ[STATE_VARIABLE])
+        self.state = state or Path(mkdtemp(prefix="btr-backup-fake-"))
+        self.state.mkdir(parents=True, exist_ok=True)
+        self.priority: list[str] = []
+
+    def metadata_path(self, path: Path) -> Path:
+        key = sha1(str(path.resolve()).encode()).hexdigest()
+        return self.state / f"{key}.json"
+
+    def load(self, path: Path) -> FakeSubvolumeInfo:
+        try:
+            data = json.loads(self.metadata_path(path).read_text())
+        except FileNotFoundError:
+            raise OSError(f"{path} is not a subvolume.") from None
+
+        return FakeSubvolumeInfo(
+            id=data["id"],
+            uuid=bytes.fromhex(data["uuid"]),
+            received_uuid=bytes.fromhex(data["received_uuid"]),
+            parent_uuid=bytes.fromhex(data["parent_uuid"]),
+            generation=data["generation"],
+            read_only=data["read_only"],
+        )
+
+    def store(self, path: Path, info: FakeSubvolumeInfo) -> None:
+        data = {
+            key: value.hex() if isinstance(value, bytes) else value
+            for key, value in asdict(info).items()
+        }
+        self.metadata_path(path).write_text(json.dumps(data))
+
+    def register(
+        self,
+        path: Path,
+        *,
+        parent_uuid: bytes = NULL_UUID,
+        received_uuid: bytes = NULL_UUID,
+        read_only: bool = False,
+    ) -> None:
+        info = FakeSubvolumeInfo(
+            id=path.stat().st_ino,
+            uuid=uuid4().bytes,
+            received_uuid=received_uuid,
+            parent_uuid=parent_uuid,
+            generation=1,
+            read_only=read_only,
+        )
+        self.store(path, info)
+
+    def make_filesystem(self, device: Path) -> None:
+        """Create a device directory whose root is the top-level subvolume."""
+        device.mkdir(parents=True)
+        self.register(device)
+
+    def is_subvolume(self, path: Path) -> bool:
+        return self.metadata_path(path).exists()
+
+    def create_subvolume(self, path: Path) -> None:
+        path.mkdir()
+        self.register(path)
+
+    def create_snapshot(self, source: Path, path: Path, *, read_only: bool) -> None:
+        copytree(source, path, symlinks=True)
+        self.register(path, parent_uuid=self.load(source).uuid, read_only=read_only)
+
+    def delete_subvolume(self, path: Path) -> None:
+        self.metadata_path(path).unlink()
+        rmtree(path)
+
+    def subvolume_id(self, path: Path) -> int:
+        return self.load(path).id
+
+    def subvolume_info(self, path: Path) -> FakeSubvolumeInfo:
+        return self.load(path)
+
+    def get_subvolume_read_only(self, path: Path) -> bool:
+        return self.load(path).read_only
+
+    def iterate_subvolumes(self, path: Path) -> Iterator[tuple[str, int]]:
+        for root, directories, _ in walk(path):
+            for directory in directories:
+                subvol = Path(root, directory)
+                if self.is_subvolume(subvol):
+                    yield str(subvol.relative_to(path)), self.subvolume_id(subvol)
+
+    def deleted_subvolumes(self, path: Path) -> list[int]:
+        return []
+
+    def qgroup_usage(self, path: Path) -> dict[int, tuple[int, int]]:
+        # Snapshots are full copies, so everything they reference is exclusive.
+        usage = {}
+        for name, subvolid in self.iterate_subvolumes(path):
+            files = (file for file in (path / name).rglob("*") if file.is_file())
+            size = sum(file.stat().st_size for file in files)
+            usage[subvolid] = (size, size)
+        return usage
+
+    def sync(self, path: Path) -> None:
+        pass
+
+    def mount(
+        self,
+        device: Path,
+        destination: Path,
+        fs: str,
+        data: str | None = None,
+    ) -> None:
+        target = device
+        if data and data.startswith("subvolid="):
+            subvolid = int(data.removeprefix("subvolid="))
+            target = next(
+                device / path
+                for path, found in self.iterate_subvolumes(device)
+                if found == subvolid
+            )
+
+        destination.rmdir()
+        destination.symlink_to(target.absolute())
+
+    def umount(self, destination: Path) -> None:
+        destination.unlink()
+        destination.mkdir()
+
+    def progs_available(self) -> bool:
+        return True
+
+    def command(self, *args: str) -> list[str]:
+        script = str(Path(__file__).resolve())
+        return [*self.priority, sys.executable, script, str(self.state), *args]
+
+    def send(
+        self,
+        subvol: Path,
+        parent: Path | None,
+        *,
+        no_data: bool = False,
+    ) -> Popen[bytes]:
+        command = self.command("send-no-data" if no_data else "send", str(subvol))
+        if parent:
+            command.append(str(parent))
+
+        return Popen(command, stdout=PIPE, stderr=DEVNULL)
+
+    def receive(self, path: Path) -> Popen[bytes]:
+        command = self.command("receive", str(path))
+        return Popen(command, stdin=PIPE, stdout=DEVNULL, stderr=DEVNULL)
+
+
+def write_command(fd: int, command: int, payload: bytes) -> None:
+    # btrfs uses crc32c, only its spread matters for archive chunk boundaries.
+    checksum = zlib.crc32(COMMAND_HEADER.pack(len(payload), command, 0) + payload)
+    write_all(fd, COMMAND_HEADER.pack(len(payload), command, checksum) + payload)
+
+
+def encode_attributes(attributes: dict[str, str | int | None], data: bytes) -> bytes:
+    encoded = json.dumps(attributes).encode()
+    return len(encoded).to_bytes(4, "little") + encoded + data
+
+
+def read_command(stream: BinaryIO) -> tuple[int, dict[str, str | int | None], bytes]:
+    length, command, _ = COMMAND_HEADER.unpack(stream.read(COMMAND_HEADER.size))
+    payload = stream.read(length)
+    if not payload:
+        return command, {}, b""
+
+    size = int.from_bytes(payload[:4], "little")
+    return command, json.loads(payload[4 : 4 + size]), payload[4 + size :]
+
+
+def send(
+    backend: FakeBackend,
+    subvol: Path,
+    parent: Path | None,
+    *,
+    no_data: bool,
+) -> None:
+    fd = sys.stdout.fileno()
+    info = backend.load(subvol)
+    uuid = info.received_uuid if info.received_uuid != NULL_UUID else info.uuid
+
+    write_all(fd, STREAM_HEADER.pack(STREAM_MAGIC, 1))
+    header = {"name": subvol.name, "uuid": uuid.hex(), "parent": parent and parent.name}
+    write_command(fd, SNAPSHOT if parent else SUBVOL, encode_attributes(header, b""))
+
+    for path in sorted(subvol.rglob("*")):
+        if not path.is_file():
+            continue
+
+        name = str(path.relative_to(subvol))
+        data = path.read_bytes()
+        for offset in range(0, max(len(data), 1), WRITE_SIZE):
+            chunk = data[offset : offset + WRITE_SIZE]
+            if no_data:
+                size = SIZE_ATTRIBUTE.pack(ATTRIBUTE_SIZE, 8, len(chunk))
+                write_command(fd, UPDATE_EXTENT, size)
+                continue
+
+            attributes = {"path": name, "offset": offset}
+            write_command(fd, WRITE, encode_attributes(attributes, chunk))
+
+    write_command(fd, END, b"")
+
+
+def receive(backend: FakeBackend, destination: Path) -> None:
+    stream = sys.stdin.buffer
+    magic, _ = STREAM_HEADER.unpack(stream.read(STREAM_HEADER.size))
+    if magic != STREAM_MAGIC:
+        raise ValueError("Not a btrfs send stream.")
+
+    _, header, _ = read_command(stream)
+    name, uuid, parent = header["name"], header["uuid"], header["parent"]
+    assert isinstance(name, str) and isinstance(uuid, str)
+
+    subvol = destination / name
+    if isinstance(parent, str):
+        copytree(destination / parent, subvol, symlinks=True)
+    else:
+        subvol.mkdir()
+    backend.register(subvol)
+
+    while True:
+        command, attributes, data = read_command(stream)
+        if command == END:
+            break
+
+        path = subvol / str(attributes["path"])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("r+b" if path.exists() else "wb") as file:
+            file.seek(int(attributes["offset"] or 0))
+            file.write(data)
+            file.truncate()
+
+    # btrfs receive reads until end of file without -e, exiting right after the
+    # end command would break the pipe of a sender that has yet to close it.
+    stream.read()
+
+    # Like btrfs receive, mark the subvolume received only once it is complete.
+    backend.register(
+        subvol,
+        received_uuid=bytes.fromhex(uuid),
+        read_only=True,
+    )
+
+
+def main(args: list[str]) -> None:
+    state, action, *paths = args
+    backend = FakeBackend(Path(state))
+
+    match action, [Path(path) for path in paths]:
+        case "send" | "send-no-data", [subvol]:
+            send(backend, subvol, None, no_data=action == "send-no-data")
+        case "send" | "send-no-data", [subvol, parent]:
+            send(backend, subvol, parent, no_data=action == "send-no-data")
+        case "receive", [destination]:
+            receive(backend, destination)
+        case _:
+            sys.exit(f"Unknown fake command {action}.")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,18 @@
+{
+  pkgs,
+  flake,
+  perSystem,
+  pname,
+  ...
+}:
+
+let
+  python = pkgs.python313.withPackages (_: [ perSystem.self.default ]);
+in
+pkgs.runCommand pname { nativeBuildInputs = [ python ]; } ''
+  # the larger sizes take minutes, run them locally before touching hot paths
+
+  python ${flake}/benchmarks/benchmark.py --sizes 10 1000 10000
+
+  touch $out
+''
@@ -0,0 +1,49 @@
+{
+  pkgs,
+  perSystem,
+  pname,
+  ...
+}:
+
+let
+  python = pkgs.python313.withPackages (_: [ perSystem.self.default ]);
+in
+pkgs.runCommand pname { nativeBuildInputs = [ python ]; } ''
+  # a --no-data stream adds the length of update extents and of nothing else
+
+  python - <<'EOF'
+  from io import BytesIO
+  from struct import Struct
+
+  from btr_backup.archive import COMMAND_HEADER, STREAM_HEADER, STREAM_MAGIC
+  from btr_backup.estimate import full_stream_size
+
+  # numbers from btrfs send.h rather than the package, which could be wrong too
+  CHOWN = 19
+  END = 21
+  UPDATE_EXTENT = 22
+
+  # type, length and value of the path, size, uid and gid attributes
+  path = Struct("<HH4s").pack(15, 4, b"file")
+  size = Struct("<HHQ").pack(4, 8, 4096)
+  uid = Struct("<HHQ").pack(6, 8, 1000)
+  gid = Struct("<HHQ").pack(7, 8, 1000)
+
+  def command(kind, payload=b""):
+      return COMMAND_HEADER.pack(len(payload), kind, 0) + payload
+
+  stream = b"".join(
+      [
+          STREAM_HEADER.pack(STREAM_MAGIC, 1),
+          command(CHOWN, path + uid + gid),
+          command(UPDATE_EXTENT, path + Struct("<HHQ").pack(3, 8, 0) + size),
+          command(END),
+      ]
+  )
+
+  estimate = full_stream_size(BytesIO(stream))
+  assert estimate == len(stream) + 4096, f"estimated {estimate} for {len(stream)}"
+  EOF
+
+  touch $out
+''
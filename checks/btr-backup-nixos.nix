@@ -41,6 +41,7 @@ pkgs.testers.nixosTest {
             enable = true;
             onCalendar = "monthly";
             keepLatest = 30;
+            keepUploaded = true;
           };
         };
       };
@@ -68,19 +69,13 @@ pkgs.testers.nixosTest {
     # snapshot service
 
     snapshot_script = read_service_script(f"{config}-snapshot.service").splitlines()
-    check, snapshot = [line for line in snapshot_script if line.startswith("btr-backup")]
-
-    assert "--dev /dev/sda1" in check, "snapshot: missing --dev"
-    assert "--chdir data" in check, "snapshot: missing --chdir"
-    assert "--include home" in check, "snapshot: missing --include"
-    assert "--include srv" in check, "snapshot: missing --include"
-    assert "check" in check, "snapshot: missing 'check' subcommand"
+    [snapshot] = [line for line in snapshot_script if line.startswith("btr-backup")]
 
     assert "--dev /dev/sda1" in snapshot, "snapshot: missing --dev"
     assert "--chdir data" in snapshot, "snapshot: missing --chdir"
     assert "--include home" in snapshot, "snapshot: missing --include"
     assert "--include srv" in snapshot, "snapshot: missing --include"
-    assert "snapshot" in snapshot, "snapshot: missing 'snapshot' subcommand"
+    assert "run check snapshot" in snapshot, "snapshot: missing 'run check snapshot' stages"
 
     # snapshot timer 
 
@@ -90,17 +85,7 @@ pkgs.testers.nixosTest {
     # upload service 
 
     upload_script = read_service_script(f"{config}-upload.service").splitlines()
-    check, check_dest, upload = [line for line in upload_script if line.startswith("btr-backup")]
-
-    assert "--dev /dev/sda1" in check, "upload: missing --dev"
-    assert "--chdir data" in check, "upload: missing --chdir"
-    assert "--include home" in check, "upload: missing --include"
-    assert "--include srv" in check, "upload: missing --include"
-    assert "check" in check, "upload: missing 'check' subcommand"
-
-    assert "--dev /dev/sdb1" in check_dest, "upload: missing --dev"
-    assert "--chdir backups" in check_dest, "upload: missing --chdir"
-    assert "check" in check_dest, "upload: missing 'check' subcommand"
+    [upload] = [line for line in upload_script if line.startswith("btr-backup")]
 
     assert "--dev /dev/sda1" in upload, "upload: missing --dev"
     assert "--chdir data" in upload, "upload: missing --chdir"
@@ -108,7 +93,7 @@ pkgs.testers.nixosTest {
     assert "--include srv" in upload, "upload: missing --include"
     assert "--dest-dev /dev/sdb1" in upload, "upload: missing --dest-dev"
     assert "--dest-chdir backups" in upload, "upload: missing --dest-chdir"
-    assert "upload" in upload, "upload: missing 'upload' subcommand"
+    assert "run check check-destination upload" in upload, "upload: missing 'run check check-destination upload' stages"
 
     # upload timer 
 
@@ -118,20 +103,15 @@ pkgs.testers.nixosTest {
     # --- remove service script contains expected options ---
 
     remove_script = read_service_script(f"{config}-remove.service").splitlines()
-    check, remove = [line for line in remove_script if line.startswith("btr-backup")]
-
-    assert "--dev /dev/sda1" in check, "upload: missing --dev"
-    assert "--chdir data" in check, "upload: missing --chdir"
-    assert "--include home" in check, "upload: missing --include"
-    assert "--include srv" in check, "upload: missing --include"
-    assert "check" in check, "upload: missing 'check' subcommand"
-
-    assert "--dev /dev/sda1" in remove, "upload: missing --dev"
-    assert "--chdir data" in remove, "upload: missing --chdir"
-    assert "--include home" in remove, "upload: missing --include"
-    assert "--include srv" in remove, "upload: missing --include"
-    assert "--keep-latest 30" in remove, "upload: missing --keep-latest"
-    assert "remove" in remove, "upload: missing 'remove' subcommand"
+    [remove] = [line for line in remove_script if line.startswith("btr-backup")]
+
+    assert "--dev /dev/sda1" in remove, "remove: missing --dev"
+    assert "--chdir data" in remove, "remove: missing --chdir"
+    assert "--include home" in remove, "remove: missing --include"
+    assert "--include srv" in remove, "remove: missing --include"
+    assert "--keep-latest 30" in remove, "remove: missing --keep-latest"
+    assert "--keep-uploaded" in remove, "remove: missing --keep-uploaded"
+    assert "run check remove" in remove, "remove: missing 'run check remove' stages"
 
     # remove timer 
 
@@ -0,0 +1,48 @@
+{
+  pkgs,
+  perSystem,
+  pname,
+  ...
+}:
+
+let
+  python = pkgs.python313.withPackages (_: [ perSystem.self.default ]);
+
+  # Cumulative import time of the btr_backup package in microseconds.
+  importBudget = 150000;
+in
+pkgs.runCommand pname { nativeBuildInputs = [ python ]; } ''
+  # parsing arguments imports only the chosen command
+
+  python - <<'EOF'
+  import sys
+
+  from btr_backup.main import parse_args
+
+  def parsed_modules(*args):
+      try:
+          parse_args(args)
+      except SystemExit:
+          pass
+      return set(sys.modules)
+
+  heavy = {"btrfsutil", "mount", "subprocess", "socket"}
+
+  loaded = parsed_modules("--help")
+  assert not heavy & loaded, f"--help imported {heavy & loaded}"
+  assert not any(m.startswith("btr_backup.commands.") for m in loaded), loaded
+
+  loaded = parsed_modules("list", "--help")
+  assert "btr_backup.commands.list" in loaded, "list: command module not imported"
+  assert "btr_backup.commands.upload" not in loaded, "list: imported upload command"
+  EOF
+
+  # import time budget
+
+  python -X importtime -c "import btr_backup" 2> importtime.log
+  cumulative=$(grep -E '\| btr_backup$' importtime.log | cut -d '|' -f 2 | tr -d ' ')
+  echo "btr_backup imported in $cumulative us, budget ${toString importBudget} us"
+  test "$cumulative" -le ${toString importBudget}
+
+  touch $out
+''
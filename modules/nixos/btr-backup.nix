@@ -28,8 +28,7 @@ let
         requires = [ "local-fs.target" ];
         path = [ cfg.package ];
         script = ''
-          btr-backup -v --dev ${device} ${mkOptFlag "--chdir" chdir} check ${mkListFlag "--include" include} ${mkListFlag "--exclude" exclude}
-          btr-backup -v --dev ${device} ${mkOptFlag "--chdir" chdir} snapshot ${mkListFlag "--include" include} ${mkListFlag "--exclude" exclude}
+          btr-backup -v --dev ${device} ${mkOptFlag "--chdir" chdir} run check snapshot ${mkListFlag "--include" include} ${mkListFlag "--exclude" exclude}
         '';
       };
     };
@@ -55,9 +54,7 @@ let
           pkgs.btrfs-progs
         ];
         script = ''
-          btr-backup -v --dev ${device} ${mkOptFlag "--chdir" chdir} check ${mkListFlag "--include" include} ${mkListFlag "--exclude" exclude}
-          btr-backup -v --dev ${destinationDevice} ${mkOptFlag "--chdir" destinationChdir} check
-          btr-backup -v --dev ${device} ${mkOptFlag "--chdir" chdir} upload ${mkListFlag "--include" include} ${mkListFlag "--exclude" exclude} --dest-dev ${destinationDevice} ${mkOptFlag "--dest-chdir" destinationChdir}
+          btr-backup -v --dev ${device} ${mkOptFlag "--chdir" chdir} run check check-destination upload ${mkListFlag "--include" include} ${mkListFlag "--exclude" exclude} --dest-dev ${destinationDevice} ${mkOptFlag "--dest-chdir" destinationChdir}
         '';
       };
     };
@@ -70,6 +67,7 @@ let
       include,
       exclude,
       keepLatest,
+      keepUploaded,
     }:
     {
       "${name}-remove" = {
@@ -79,8 +77,7 @@ let
         requires = [ "local-fs.target" ];
         path = [ cfg.package ];
         script = ''
-          btr-backup -v --dev ${device} ${mkOptFlag "--chdir" chdir} check ${mkListFlag "--include" include} ${mkListFlag "--exclude" exclude}
-          btr-backup -v --dev ${device} ${mkOptFlag "--chdir" chdir} remove ${mkListFlag "--include" include} ${mkListFlag "--exclude" exclude} --keep-latest ${toString keepLatest}
+          btr-backup -v --dev ${device} ${mkOptFlag "--chdir" chdir} run check remove ${mkListFlag "--include" include} ${mkListFlag "--exclude" exclude} --keep-latest ${toString keepLatest} ${lib.optionalString keepUploaded "--keep-uploaded"}
         '';
       };
     };
@@ -114,7 +111,7 @@ let
         include
         exclude
         ;
-      inherit (instanceCfg.remove) keepLatest;
+      inherit (instanceCfg.remove) keepLatest keepUploaded;
     });
 
   mkTimer =
@@ -259,6 +256,15 @@ in
                 description = "Number of most-recent snapshots to keep per subvolume (passed as --keep-latest).";
                 example = 7;
               };
+
+              keepUploaded = lib.mkOption {
+                type = lib.types.bool;
+                default = false;
+                description = ''
+                  Also keep the latest snapshot uploaded to each destination, so the next
+                  upload can stay incremental (passed as --keep-uploaded).
+                '';
+              };
             };
           };
         }
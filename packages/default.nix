@@ -14,4 +14,12 @@ let
     };
   };
 in
-python.pkgs.buildPythonPackage (attrs // { propagatedBuildInputs = [ pkgs.btrfs-progs ]; })
+python.pkgs.buildPythonPackage (
+  attrs
+  // {
+    propagatedBuildInputs = [
+      pkgs.btrfs-progs
+      pkgs.util-linux
+    ];
+  }
+)
@@ -0,0 +1,158 @@
+import json
+import zlib
+from collections.abc import Iterator
+from hashlib import sha256
+from pathlib import Path
+from struct import Struct
+from typing import BinaryIO, TypedDict
+
+from btr_backup.common import STATE_DIR, write_atomic
+from btr_backup.stream import throttle, write_all
+
+STREAM_HEADER = Struct("<13sI")
+STREAM_MAGIC = b"btrfs-stream\0"
+COMMAND_HEADER = Struct("<IHI")
+
+# Command and attribute types of version 1 btrfs send streams.
+SUBVOL = 1
+SNAPSHOT = 2
+WRITE = 15
+END = 21
+UPDATE_EXTENT = 22
+ATTRIBUTE_SIZE = 4
+
+COMPRESSION = "zlib"
+COMPRESSION_LEVEL = 6
+
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+# A chunk ends after a command whose checksum has these bits clear, which
+# cuts on average every 16 commands once the chunk reached MIN_CHUNK_SIZE.
+BOUNDARY_MASK = 0xF
+
+
+class Manifest(TypedDict):
+    uuid: str
+    parent_uuid: str | None
+    size: int
+    compression: str
+    chunks: list[str]
+
+
+def chunk_store(archive: Path) -> Path:
+    return archive / STATE_DIR / "chunks"
+
+
+def read_exact(stream: BinaryIO, size: int) -> bytes:
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError("Send stream is truncated.")
+    return data
+
+
+def send_stream_commands(stream: BinaryIO) -> Iterator[tuple[bytes, int]]:
+    """Split a btrfs send stream into raw commands paired with their checksums."""
+    header = read_exact(stream, STREAM_HEADER.size)
+    magic, _version = STREAM_HEADER.unpack(header)
+    if magic != STREAM_MAGIC:
+        raise ValueError("Not a btrfs send stream.")
+
+    yield header, 0
+
+    while command := stream.read(COMMAND_HEADER.size):
+        if len(command) != COMMAND_HEADER.size:
+            raise ValueError("Send stream is truncated.")
+
+        length, _type, checksum = COMMAND_HEADER.unpack(command)
+        yield command + read_exact(stream, length), checksum
+
+
+def content_chunks(stream: BinaryIO) -> Iterator[bytes]:
+    """Group send stream commands into content-defined chunks.
+
+    Boundaries only fall between commands and are chosen by the crc32c every
+    command already carries, so identical runs of commands in different
+    streams produce identical chunks without hashing every byte.
+    """
+    parts: list[bytes] = []
+    size = 0
+
+    for command, checksum in send_stream_commands(stream):
+        parts.append(command)
+        size += len(command)
+
+        if size >= MAX_CHUNK_SIZE or (
+            size >= MIN_CHUNK_SIZE and not checksum & BOUNDARY_MASK
+        ):
+            yield b"".join(parts)
+            parts.clear()
+            size = 0
+
+    if parts:
+        yield b"".join(parts)
+
+
+def store_chunk(store: Path, chunk: bytes) -> tuple[str, int]:
+    digest = sha256(chunk).hexdigest()
+    path = store / digest[:2] / digest
+
+    if path.exists():
+        return digest, 0
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = zlib.compress(chunk, COMPRESSION_LEVEL)
+    write_atomic(path, data)
+
+    return digest, len(data)
+
+
+def archive_stream(source: int, store: Path) -> tuple[list[str], int, int]:
+    """Store a send stream read from source as deduplicated compressed chunks.
+
+    Returns the chunk digests, the stream size and the number of bytes that
+    were newly written to the store.
+    """
+    digests, size, stored = [], 0, 0
+
+    with open(source, "rb", closefd=False) as stream:
+        for chunk in content_chunks(stream):
+            throttle.consume(len(chunk))
+            digest, written = store_chunk(store, chunk)
+            digests.append(digest)
+            size += len(chunk)
+            stored += written
+
+    return digests, size, stored
+
+
+def restore_stream(store: Path, manifest: Manifest, sink: int) -> int:
+    """Write an archived send stream to sink, returning its size.
+
+    Raises ValueError for chunks that are missing, unreadable or corrupted,
+    errors writing to sink propagate as they are.
+    """
+    for digest in manifest["chunks"]:
+        try:
+            chunk = zlib.decompress((store / digest[:2] / digest).read_bytes())
+        except (OSError, zlib.error) as e:
+            raise ValueError(f"Chunk {digest} cannot be read: {e}") from e
+        if sha256(chunk).hexdigest() != digest:
+            raise ValueError(f"Chunk {digest} is corrupted.")
+        write_all(sink, chunk)
+
+    return manifest["size"]
+
+
+def manifest_path(directory: Path, name: str) -> Path:
+    return directory / f"{name}.json"
+
+
+def write_manifest(directory: Path, name: str, manifest: Manifest) -> None:
+    write_atomic(manifest_path(directory, name), json.dumps(manifest).encode())
+
+
+def load_manifests(directory: Path) -> dict[str, Manifest]:
+    return {
+        path.name.removesuffix(".json"): json.loads(path.read_text())
+        for path in directory.glob("*.json")
+    }
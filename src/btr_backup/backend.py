@@ -0,0 +1,163 @@
+import re
+from collections.abc import Iterator
+from os import fspath
+from pathlib import Path
+from subprocess import DEVNULL, PIPE, Popen, run
+from typing import Protocol
+
+import btrfsutil
+import mount
+
+# Level 0 qgroups of `btrfs qgroup show --raw`, one per subvolume id.
+QGROUP_LINE = re.compile(r"^0/(\d+)\s+(\d+)\s+(\d+)", re.MULTILINE)
+
+
+class SubvolumeInfo(Protocol):
+    id: int
+    uuid: bytes
+    received_uuid: bytes
+    generation: int
+
+
+class Backend(Protocol):
+    """Subvolume, mount and send/receive operations the commands rely on."""
+
+    # Command prefix setting the I/O priority of send and receive, like ionice.
+    priority: list[str]
+
+    def is_subvolume(self, path: Path) -> bool: ...
+
+    def create_subvolume(self, path: Path) -> None: ...
+
+    def create_snapshot(self, source: Path, path: Path, *, read_only: bool) -> None: ...
+
+    def delete_subvolume(self, path: Path) -> None: ...
+
+    def subvolume_id(self, path: Path) -> int: ...
+
+    def subvolume_info(self, path: Path) -> SubvolumeInfo: ...
+
+    def get_subvolume_read_only(self, path: Path) -> bool: ...
+
+    def iterate_subvolumes(self, path: Path) -> Iterator[tuple[str, int]]: ...
+
+    def deleted_subvolumes(self, path: Path) -> list[int]: ...
+
+    def qgroup_usage(self, path: Path) -> dict[int, tuple[int, int]]:
+        """Referenced and exclusive bytes of every subvolume by subvolume id."""
+        ...
+
+    def sync(self, path: Path) -> None: ...
+
+    def mount(
+        self,
+        device: Path,
+        destination: Path,
+        fs: str,
+        data: str | None = None,
+    ) -> None: ...
+
+    def umount(self, destination: Path) -> None: ...
+
+    def progs_available(self) -> bool: ...
+
+    def send(
+        self,
+        subvol: Path,
+        parent: Path | None,
+        *,
+        no_data: bool = False,
+    ) -> Popen[bytes]: ...
+
+    def receive(self, path: Path) -> Popen[bytes]: ...
+
+
+class BtrfsBackend:
+    """Backend operating on btrfs filesystems through btrfsutil and btrfs-progs."""
+
+    def __init__(self) -> None:
+        self.priority: list[str] = []
+
+    def is_subvolume(self, path: Path) -> bool:
+        return btrfsutil.is_subvolume(path)
+
+    def create_subvolume(self, path: Path) -> None:
+        btrfsutil.create_subvolume(path)
+
+    def create_snapshot(self, source: Path, path: Path, *, read_only: bool) -> None:
+        btrfsutil.create_snapshot(source, path, read_only=read_only)
+
+    def delete_subvolume(self, path: Path) -> None:
+        btrfsutil.delete_subvolume(path)
+
+    def subvolume_id(self, path: Path) -> int:
+        return btrfsutil.subvolume_id(path)
+
+    def subvolume_info(self, path: Path) -> SubvolumeInfo:
+        return btrfsutil.subvolume_info(path)
+
+    def get_subvolume_read_only(self, path: Path) -> bool:
+        return btrfsutil.get_subvolume_read_only(path)
+
+    def iterate_subvolumes(self, path: Path) -> Iterator[tuple[str, int]]:
+        with btrfsutil.SubvolumeIterator(path) as iterator:
+            yield from iterator
+
+    def deleted_subvolumes(self, path: Path) -> list[int]:
+        return btrfsutil.deleted_subvolumes(path)
+
+    def qgroup_usage(self, path: Path) -> dict[int, tuple[int, int]]:
+        # btrfsutil has no quota support, one listing reads the whole quota tree.
+        command = ["btrfs", "qgroup", "show", "--raw", str(path)]
+        result = run(command, stdin=DEVNULL, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise OSError(result.stderr.strip() or "btrfs qgroup show failed")
+
+        return {
+            int(qgroup): (int(referenced), int(exclusive))
+            for qgroup, referenced, exclusive in QGROUP_LINE.findall(result.stdout)
+        }
+
+    def sync(self, path: Path) -> None:
+        btrfsutil.sync(path)
+
+    def mount(
+        self,
+        device: Path,
+        destination: Path,
+        fs: str,
+        data: str | None = None,
+    ) -> None:
+        if data is None:
+            mount.mount(fspath(device), fspath(destination), fs)
+        else:
+            mount.mount(fspath(device), fspath(destination), fs, data=data)
+
+    def umount(self, destination: Path) -> None:
+        mount.umount(fspath(destination))
+
+    def progs_available(self) -> bool:
+        command = ["btrfs", "--help"]
+        return run(command, stdout=DEVNULL, stderr=DEVNULL).returncode == 0
+
+    def send(
+        self,
+        subvol: Path,
+        parent: Path | None,
+        *,
+        no_data: bool = False,
+    ) -> Popen[bytes]:
+        command = [*self.priority, "btrfs", "send", str(subvol)]
+        if parent:
+            command.extend(["-p", str(parent)])
+        if no_data:
+            command.append("--no-data")
+
+        return Popen(command, stdout=PIPE, stderr=DEVNULL)
+
+    def receive(self, path: Path) -> Popen[bytes]:
+        command = [*self.priority, "btrfs", "receive", str(path)]
+        return Popen(command, stdin=PIPE, stdout=DEVNULL, stderr=DEVNULL)
+
+
+backend: Backend = BtrfsBackend()
@@ -0,0 +1,56 @@
+from pathlib import Path
+
+from btr_backup.backend import backend
+from btr_backup.catalog import snapshot_info, snapshot_removed
+from btr_backup.log import logger
+
+
+def send_uuid(subvol: Path) -> bytes:
+    # btrfs send identifies a subvolume by its received UUID when it was itself
+    # received and by its own UUID otherwise, receive matches it against the
+    # received UUID of subvolumes on the destination.
+    info = snapshot_info(subvol)
+    return bytes.fromhex(info["received_uuid"] or info["uuid"])
+
+
+def is_received(subvol: Path) -> bool:
+    # btrfs receive sets the received UUID and the read-only flag only after
+    # the whole stream was applied.
+    info = snapshot_info(subvol)
+    return info["read_only"] and info["received_uuid"] is not None
+
+
+def is_partial(subvol: Path) -> bool:
+    if not backend.is_subvolume(subvol):
+        return False
+
+    info = snapshot_info(subvol)
+    return not info["read_only"] and info["received_uuid"] is None
+
+
+def remove_partial(subvol: Path) -> None:
+    if not is_partial(subvol):
+        return
+
+    logger.warning("Removing partially received snapshot %s.", subvol)
+    backend.delete_subvolume(subvol)
+    snapshot_removed(subvol)
+
+
+def subvolume_root(path: Path) -> Path:
+    while not backend.is_subvolume(path):
+        path = path.parent
+    return path
+
+
+def subvolumes_below(directory: Path) -> set[Path]:
+    # A single tree search lists every subvolume, instead of an ioctl per entry.
+    # Paths are relative to the subvolume containing the directory.
+    root = subvolume_root(directory)
+    prefix = directory.relative_to(root)
+
+    return {
+        root / path
+        for path, _ in backend.iterate_subvolumes(root)
+        if Path(path).is_relative_to(prefix)
+    }
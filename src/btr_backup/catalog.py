@@ -0,0 +1,190 @@
+import json
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+from typing import TypedDict
+
+from btr_backup.backend import backend
+from btr_backup.common import STATE_DIR, write_atomic
+
+CATALOG_FILE = "catalog.json"
+NULL_UUID = bytes(16)
+
+
+class SnapshotInfo(TypedDict):
+    id: int
+    uuid: str
+    received_uuid: str | None
+    generation: int
+    read_only: bool
+    timestamp: float | None
+
+
+class DirectoryEntry(TypedDict):
+    mtime: int
+    snapshots: dict[str, SnapshotInfo | None]
+
+
+def snapshot_timestamp(name: str) -> float | None:
+    try:
+        return datetime.fromisoformat(name).timestamp()
+    except ValueError:
+        return None
+
+
+def read_snapshot_info(subvol: Path) -> SnapshotInfo:
+    info = backend.subvolume_info(subvol)
+    return SnapshotInfo(
+        id=info.id,
+        uuid=info.uuid.hex(),
+        received_uuid=(
+            info.received_uuid.hex() if info.received_uuid != NULL_UUID else None
+        ),
+        generation=info.generation,
+        read_only=backend.get_subvolume_read_only(subvol),
+        timestamp=snapshot_timestamp(subvol.name),
+    )
+
+
+def verified_info(subvol: Path, info: SnapshotInfo | None) -> SnapshotInfo | None:
+    """Cached details of subvol, unless they describe another subvolume."""
+    if info is None:
+        return None
+
+    try:
+        return info if backend.subvolume_id(subvol) == info["id"] else None
+    except OSError:
+        return None
+
+
+class Catalog:
+    """Persistent listing of the snapshots in the logical directories of a workdir.
+
+    A directory listing is reused for as long as the modification time of the
+    logical directory is unchanged, which btrfs bumps whenever a snapshot is
+    created, deleted or renamed in it. Subvolume details are only reused for
+    read-only snapshots, the only ones whose UUIDs can no longer change, and
+    are checked against the subvolume id when the directory is listed again,
+    as the snapshot may have been replaced by another of the same name.
+    """
+
+    def __init__(self, workdir: Path) -> None:
+        self.path = workdir / STATE_DIR / CATALOG_FILE
+        self.lock = Lock()
+        self.dirty = False
+        self.listed: set[str] = set()
+
+        try:
+            self.directories: dict[str, DirectoryEntry] = json.loads(
+                self.path.read_text()
+            )
+        except (OSError, ValueError):
+            self.directories = {}
+
+    def entry(self, directory: Path) -> DirectoryEntry:
+        mtime = directory.stat().st_mtime_ns
+        entry = self.directories.get(directory.name)
+
+        if entry is None or entry["mtime"] != mtime:
+            known = entry["snapshots"] if entry else {}
+            names = sorted(
+                (path.name for path in directory.iterdir() if path.name != "active"),
+                reverse=True,
+            )
+            entry = DirectoryEntry(
+                mtime=mtime,
+                snapshots={
+                    name: verified_info(directory / name, known.get(name))
+                    for name in names
+                },
+            )
+            self.directories[directory.name] = entry
+            self.dirty = True
+
+        self.listed.add(directory.name)
+        return entry
+
+    def snapshots(self, directory: Path) -> list[str]:
+        with self.lock:
+            return list(self.entry(directory)["snapshots"])
+
+    def info(self, subvol: Path) -> SnapshotInfo:
+        with self.lock:
+            snapshots = self.entry(subvol.parent)["snapshots"]
+            cached = snapshots.get(subvol.name)
+            if cached and cached["read_only"]:
+                return cached
+
+            info = read_snapshot_info(subvol)
+            if subvol.name in snapshots:
+                snapshots[subvol.name] = info
+                self.dirty = True
+
+            return info
+
+    def update(self, directory: Path, added: str | None, removed: str | None) -> None:
+        with self.lock:
+            # Patch a listing validated earlier instead of reading the directory
+            # again, but keep the modification time it was validated at. The
+            # change being recorded bumped it, and so may have other processes
+            # since, the next read lists the directory again to find out.
+            if directory.name in self.listed:
+                entry = self.directories[directory.name]
+            else:
+                entry = self.entry(directory)
+            snapshots = entry["snapshots"]
+            if removed:
+                snapshots.pop(removed, None)
+            if added:
+                snapshots[added] = None
+                snapshots = dict(sorted(snapshots.items(), reverse=True))
+
+            self.directories[directory.name] = DirectoryEntry(
+                mtime=entry["mtime"],
+                snapshots=snapshots,
+            )
+            self.dirty = True
+
+    def save(self) -> None:
+        with self.lock:
+            if not self.dirty:
+                return
+
+            self.path.parent.mkdir(exist_ok=True)
+            write_atomic(self.path, json.dumps(self.directories).encode())
+            self.dirty = False
+
+
+catalogs: dict[Path, Catalog] = {}
+catalogs_lock = Lock()
+
+
+def catalog_for(workdir: Path) -> Catalog:
+    with catalogs_lock:
+        if workdir not in catalogs:
+            catalogs[workdir] = Catalog(workdir)
+        return catalogs[workdir]
+
+
+def snapshots_for(dir: Path) -> list[str]:
+    return catalog_for(dir.parent).snapshots(dir)
+
+
+def snapshot_info(subvol: Path) -> SnapshotInfo:
+    return catalog_for(subvol.parent.parent).info(subvol)
+
+
+def snapshot_added(subvol: Path) -> None:
+    catalog_for(subvol.parent.parent).update(subvol.parent, subvol.name, None)
+
+
+def snapshot_removed(subvol: Path) -> None:
+    catalog_for(subvol.parent.parent).update(subvol.parent, None, subvol.name)
+
+
+def save_catalogs() -> None:
+    with catalogs_lock:
+        opened = list(catalogs.values())
+
+    for catalog in opened:
+        catalog.save()
@@ -0,0 +1,164 @@
+import json
+from collections.abc import Collection, Iterator
+from hashlib import sha256
+from os import fsync, read
+from pathlib import Path
+from shutil import rmtree
+from typing import TypedDict
+
+from btr_backup.common import STATE_DIR
+from btr_backup.log import logger
+from btr_backup.stream import DEFAULT_BUFFER_SIZE, throttle
+
+PROGRESS_FILE = "progress.json"
+PARTIAL_DIR = "partial"
+DEFAULT_CHECKPOINT_SIZE = 256 * 1024 * 1024
+
+
+class Progress(TypedDict):
+    parent: str | None
+    chunk_size: int
+    chunks: list[str]
+    complete: bool
+
+
+def load_progress(staging: Path, parent: str | None, chunk_size: int) -> Progress:
+    fresh = Progress(parent=parent, chunk_size=chunk_size, chunks=[], complete=False)
+
+    try:
+        progress: Progress = json.loads((staging / PROGRESS_FILE).read_text())
+    except (OSError, ValueError):
+        return fresh
+
+    if progress["parent"] != parent or progress["chunk_size"] != chunk_size:
+        logger.warning("Discarding checkpoint in %s made for another stream.", staging)
+        return fresh
+
+    return progress
+
+
+def save_progress(staging: Path, progress: Progress) -> None:
+    temporary = staging / f"{PROGRESS_FILE}.tmp"
+    with temporary.open("w") as file:
+        json.dump(progress, file)
+        file.flush()
+        fsync(file.fileno())
+    temporary.replace(staging / PROGRESS_FILE)
+
+
+def staging_directory(workdir: Path, directory: str) -> Path:
+    """Directory holding the checkpoints of a logical directory's uploads."""
+    return workdir / STATE_DIR / PARTIAL_DIR / directory
+
+
+def prune_staging(staging: Path, keep: Collection[str]) -> None:
+    """Remove the checkpoints of every snapshot in staging but those in keep."""
+    if not staging.is_dir():
+        return
+
+    for path in staging.iterdir():
+        if path.name not in keep:
+            logger.info("Removing abandoned checkpoint %s.", path)
+            rmtree(path, ignore_errors=True)
+
+    if not keep:
+        rmtree(staging, ignore_errors=True)
+
+
+def chunk_path(staging: Path, index: int) -> Path:
+    return staging / f"{index:08d}"
+
+
+def copy_chunk(source: int, path: Path, size: int) -> tuple[int, str, bool]:
+    """Read up to size bytes from source into the chunk file at path.
+
+    The data is written as it is read, only a chunk file that differs from it
+    is written to. Returns the number of bytes read, their sha256 digest and
+    whether the chunk file changed.
+    """
+    digest = sha256()
+    length = 0
+    changed = False
+
+    with path.open("r+b" if path.exists() else "w+b") as file:
+        while length < size and (
+            part := read(source, min(size - length, DEFAULT_BUFFER_SIZE))
+        ):
+            throttle.consume(len(part))
+            digest.update(part)
+
+            if not changed and file.read(len(part)) != part:
+                changed = True
+                file.seek(length)
+            if changed:
+                file.write(part)
+
+            length += len(part)
+
+        if changed or file.read(1):
+            file.truncate(length)
+            file.flush()
+            fsync(file.fileno())
+            changed = True
+
+    return length, digest.hexdigest(), changed
+
+
+def checkpoint_stream(
+    source: int,
+    staging: Path,
+    progress: Progress,
+) -> tuple[int, int]:
+    """Persist a send stream read from source as chunks in staging.
+
+    btrfs send cannot seek, so a resumed stream is regenerated from the start,
+    chunks that were already persisted are only read back and compared. The
+    stream is never held in memory beyond a buffer. Returns the number of
+    chunks and bytes in the stream.
+    """
+    staging.mkdir(parents=True, exist_ok=True)
+
+    chunks = progress["chunks"]
+    written = 0
+    size = 0
+    index = 0
+
+    while True:
+        path = chunk_path(staging, index)
+        length, digest, changed = copy_chunk(source, path, progress["chunk_size"])
+        if not length:
+            path.unlink()
+            break
+
+        size += length
+
+        if index < len(chunks) and chunks[index] == digest and not changed:
+            index += 1
+            continue
+
+        if index < len(chunks):
+            logger.warning(
+                "Send stream diverged from checkpoint at chunk %d, rewriting.", index
+            )
+            del chunks[index:]
+
+        chunks.append(digest)
+        save_progress(staging, progress)
+
+        if changed:
+            written += length
+        index += 1
+
+    logger.debug("Checkpointed %d new bytes in %s.", written, staging)
+
+    return index, size
+
+
+def complete_checkpoint(staging: Path, progress: Progress, count: int) -> None:
+    del progress["chunks"][count:]
+    progress["complete"] = True
+    save_progress(staging, progress)
+
+
+def checkpointed_chunks(staging: Path, progress: Progress) -> Iterator[Path]:
+    return (chunk_path(staging, index) for index in range(len(progress["chunks"])))
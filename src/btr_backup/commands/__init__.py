@@ -1,22 +1,46 @@
-from btr_backup.commands.check import add_command as add_check_command
-from btr_backup.commands.graph import add_command as add_graph_command
-from btr_backup.commands.init import add_command as add_init_command
-from btr_backup.commands.list import add_command as add_list_command
-from btr_backup.commands.remove import add_command as add_remove_command
-from btr_backup.commands.snapshot import add_command as add_snapshot_command
-from btr_backup.commands.upload import add_command as add_upload_command
+from argparse import ArgumentParser, Namespace
+from collections.abc import Sequence
+from importlib import import_module
+from typing import Any
+
 from btr_backup.protocols import Subparsers
 
+# Help of each command, its module in this package is imported only once the
+# command is chosen, so that --help and other commands skip its dependencies.
+COMMANDS = {
+    "check": "Check subvolumes structure.",
+    "daemon": "Keep devices mounted and run snapshot, upload and remove jobs.",
+    "graph": "Graph available subvolumes.",
+    "init": "Initialize a logical directory for subvolumes.",
+    "list": "List available subvolumes.",
+    "remove": "Remove selected subvolumes.",
+    "restore": "Receive archived snapshots back into btrfs subvolumes.",
+    "run": "Run several commands in order within a single mount.",
+    "snapshot": "Snapshot selected subvolumes.",
+    "upload": "Copy snapshots from one btrfs filesystem to another.",
+    "verify": "Check that uploaded snapshots are complete and match their sources.",
+}
+
+
+class CommandParser(ArgumentParser):
+    """Parser of a command that adds its arguments when it is first used."""
+
+    def __init__(self, *args: Any, module: str | None = None, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.module = module
+
+    def parse_known_args(
+        self,
+        args: Sequence[str] | None = None,
+        namespace: Namespace | None = None,
+    ) -> tuple[Namespace, list[str]]:
+        if self.module is not None:
+            import_module(self.module).add_arguments(self)
+            self.module = None
+
+        return super().parse_known_args(args, namespace)
+
 
 def add_commands(subparsers: Subparsers) -> None:
-    add_command_list = [
-        add_check_command,
-        add_graph_command,
-        add_init_command,
-        add_list_command,
-        add_remove_command,
-        add_snapshot_command,
-        add_upload_command,
-    ]
-    for add_command in add_command_list:
-        add_command(subparsers)
+    for name, help in COMMANDS.items():
+        subparsers.add_parser(name, help=help, module=f"{__name__}.{name}")
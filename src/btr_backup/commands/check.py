@@ -1,28 +1,55 @@
-from datetime import datetime
-from itertools import filterfalse
+import re
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from operator import attrgetter
 from pathlib import Path
 from typing import Any
 
-from btrfsutil import is_subvolume
-
-from btr_backup.common import include_exclude
+from btr_backup.btrfs import subvolumes_below
+from btr_backup.common import include_exclude, logical_directories
+from btr_backup.lock import locks
 from btr_backup.log import logger
-from btr_backup.protocols import Subparsers
+from btr_backup.metrics import metrics
 
+# Snapshot names are created with "%Y-%m-%dT%H:%M:%S%:z".
+SNAPSHOT_NAME = re.compile(
+    r"\d{4}-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])"
+    r"T([01]\d|2[0-3]):[0-5]\d:[0-5]\d"
+    r"(Z|[+-]([01]\d|2[0-3]):?[0-5]\d)"
+)
 
-def datetime_like(date: str, fmt: str) -> bool:
-    try:
-        datetime.strptime(date, fmt)
-    except ValueError:
-        return False
-    return True
 
+def check_subvolume_name(name: str) -> bool:
+    return name == "active" or SNAPSHOT_NAME.fullmatch(name) is not None
 
-def check_subvolume_name(subvolume: Path) -> bool:
-    return subvolume.name == "active" or datetime_like(
-        subvolume.name, "%Y-%m-%dT%H:%M:%S%z"
-    )
+
+def check_directory(directory: Path, subvolumes: set[Path]) -> list[str]:
+    logger.info("Verifying %s", directory)
+
+    with metrics.measure("check", directory.name):
+        if not directory.is_dir():
+            return [f"Path {directory} is not a directory."]
+
+        extra = []
+        invalid = []
+
+        for path in directory.iterdir():
+            if path not in subvolumes:
+                extra.append(path)
+            if not check_subvolume_name(path.name):
+                invalid.append(path)
+
+    problems = []
+
+    if extra:
+        extra_str = ", ".join(str(p) for p in extra)
+        problems.append(f"Only subvolumes allowed in {directory}: {extra_str}")
+
+    if invalid:
+        invalid_str = ", ".join(str(p) for p in invalid)
+        problems.append(f"Invalid subvolume names in {directory}: {invalid_str}")
+
+    return problems
 
 
 def check_structure(
@@ -30,53 +57,56 @@ def check_structure(
     *,
     include: list[str],
     exclude: list[str],
+    jobs: int,
     **kwargs: Any,
 ) -> bool:
-    logger.info(f"Verifying {workdir.name} existence")
+    logger.info("Verifying %s existence", workdir.name)
     if not workdir.exists():
-        logger.error(f"Path {workdir} does not exist.")
+        logger.error("Path %s does not exist.", workdir)
         return False
 
-    logger.info(f"Verifying {workdir.name} is a directory")
+    logger.info("Verifying %s is a directory", workdir.name)
     if not workdir.is_dir():
-        logger.error(f"Path {workdir} is not a directory.")
+        logger.error("Path %s is not a directory.", workdir)
         return False
 
-    directories = include_exclude(
-        workdir.iterdir(),
-        include,
-        exclude,
-        attrgetter("name"),
-    )
-    for directory in directories:
-        logger.info(f"Verifying {directory} is a directory")
-        if not directory.is_dir():
-            logger.error(f"Path {directory} is not a directory.")
-            return False
+    with metrics.measure("enumerate"):
+        directories = include_exclude(
+            logical_directories(workdir),
+            include,
+            exclude,
+            attrgetter("name"),
+        )
+        subvolumes = subvolumes_below(workdir)
 
-        logger.info(f"Verifying contents of {directory} are subvolumes")
-        if extra := list(filterfalse(is_subvolume, directory.iterdir())):
-            extra_str = ", ".join(str(p) for p in extra)
-            logger.error(f"Only subvolumes allowed in {directory}: {extra_str}")
-            return False
+    def check(directory: Path) -> list[str]:
+        with locks.hold(directory, exclusive=False) as held:
+            return check_directory(directory, subvolumes) if held else []
 
-        logger.info(f"Verifying contents of {directory} are named correctly")
-        if invalid := list(filterfalse(check_subvolume_name, directory.iterdir())):
-            invalid_str = ", ".join(str(p) for p in invalid)
-            logger.error(f"Invalid subvolume names in {directory}: {invalid_str}")
-            return False
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(check, directories)
+        problems = [problem for result in results for problem in result]
+
+    for problem in problems:
+        logger.error(problem)
+
+    if problems:
+        logger.error("Structure is invalid, found %d problems.", len(problems))
+        return False
 
     logger.info("Structure is valid.")
 
     return True
 
 
-def add_command(subparsers: Subparsers) -> None:
-    parser = subparsers.add_parser(
-        "check",
-        help="Check subvolumes structure.",
+def add_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of logical directories to check concurrently.",
     )
-
     group = parser.add_mutually_exclusive_group()
 
     group.add_argument(
@@ -0,0 +1,296 @@
+from argparse import ArgumentParser
+from collections.abc import Callable
+from contextlib import ExitStack
+from functools import partial
+from pathlib import Path
+from signal import SIGTERM, signal
+from socket import AF_UNIX, SOCK_STREAM, socket
+from sys import exit
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import Any
+
+from btr_backup.catalog import save_catalogs
+from btr_backup.commands.remove import add_remove_arguments, remove_subvolumes
+from btr_backup.commands.snapshot import add_snapshot_arguments, snapshot_subvolumes
+from btr_backup.commands.upload import (
+    add_upload_arguments,
+    mount_destinations,
+    upload_snapshots,
+)
+from btr_backup.log import logger
+from btr_backup.metrics import export_metrics, metrics
+
+CLIENT_TIMEOUT = 5.0
+
+type Job = Callable[[], bool]
+
+
+def run_job(name: str, job: Job, export: Callable[[], None]) -> bool:
+    logger.info("Running %s job.", name)
+
+    try:
+        success = job()
+    except Exception:
+        # A bug in one job must not take the daemon and its schedule down.
+        logger.exception("Job %s raised an error.", name)
+        success = False
+
+    # Persist catalogs and metrics after every job, the daemon may run for weeks.
+    save_catalogs()
+    metrics.record_job(name, success)
+    try:
+        export()
+    except OSError as e:
+        logger.warning("Failed to export metrics: %s", e)
+
+    if not success:
+        logger.error("Job %s failed.", name)
+
+    return success
+
+
+class JobRunner:
+    """Runs daemon jobs in threads of their own, each job once at a time.
+
+    A long upload thereby holds back neither snapshots nor clients, and runs
+    of different jobs only contend for the directory locks. A scheduled run
+    is skipped while the previous run of its job is still going, a run asked
+    for by a client waits for it and then runs again.
+    """
+
+    def __init__(self, jobs: dict[str, Job]) -> None:
+        self.jobs = jobs
+        self.running = {name: Lock() for name in jobs}
+        self.threads: list[Thread] = []
+
+    def start(self, target: Callable[..., object], *args: object) -> None:
+        self.threads = [thread for thread in self.threads if thread.is_alive()]
+        thread = Thread(target=target, args=args)
+        self.threads.append(thread)
+        thread.start()
+
+    def run_locked(self, name: str) -> bool:
+        try:
+            return self.jobs[name]()
+        finally:
+            self.running[name].release()
+
+    def schedule(self, name: str) -> None:
+        if not self.running[name].acquire(blocking=False):
+            logger.warning("Job %s is still running, skipping.", name)
+            return
+        self.start(self.run_locked, name)
+
+    def request(self, name: str) -> bool:
+        self.running[name].acquire()
+        return self.run_locked(name)
+
+    def join(self) -> None:
+        if any(thread.is_alive() for thread in self.threads):
+            logger.info("Waiting for running jobs to finish.")
+        for thread in self.threads:
+            thread.join()
+
+
+def handle_client(client: socket, runner: JobRunner) -> None:
+    client.settimeout(CLIENT_TIMEOUT)
+
+    with client, client.makefile("rw") as stream:
+        # Text mode decodes as it reads, garbage raises a ValueError.
+        try:
+            name = stream.readline().strip()
+        except (OSError, ValueError) as e:
+            logger.warning("Client did not send a job name, disconnecting: %s", e)
+            return
+
+        if name not in runner.jobs:
+            stream.write(f"unknown job {name}\n")
+        elif runner.request(name):
+            stream.write("ok\n")
+        else:
+            stream.write("failed\n")
+
+        try:
+            stream.flush()
+        except OSError as e:
+            logger.warning("Failed to reply to client: %s", e)
+
+
+def serve(
+    runner: JobRunner,
+    intervals: dict[str, float],
+    server: socket | None,
+) -> None:
+    due = {name: monotonic() + interval for name, interval in intervals.items()}
+
+    while True:
+        timeout = max(min(due.values()) - monotonic(), 0) if due else None
+
+        if server is None:
+            if timeout is None:
+                logger.error("Nothing scheduled and no socket to listen on.")
+                return
+            sleep(timeout)
+        else:
+            server.settimeout(timeout)
+            try:
+                client, _ = server.accept()
+            except TimeoutError:
+                pass
+            else:
+                runner.start(handle_client, client, runner)
+
+        for name, interval in intervals.items():
+            if due[name] <= monotonic():
+                runner.schedule(name)
+                due[name] = monotonic() + interval
+
+
+def terminate(signum: int, frame: Any) -> None:
+    logger.info("Received signal %d, shutting down.", signum)
+    exit(0)
+
+
+def run_daemon(
+    workdir: Path,
+    *,
+    socket_path: Path | None,
+    snapshot_interval: float | None,
+    upload_interval: float | None,
+    remove_interval: float | None,
+    dest_dev: list[Path] | None,
+    dest_command: list[list[str]] | None,
+    dest_chdir: Path,
+    archive_dir: Path | None,
+    metrics_json: Path | None,
+    metrics_prometheus: Path | None,
+    **kwargs: Any,
+) -> bool:
+    # systemd stops services with SIGTERM, unwind so devices get unmounted.
+    signal(SIGTERM, terminate)
+
+    with ExitStack() as stack:
+        dest_workdirs = None
+        if dest_dev:
+            dest_workdirs = mount_destinations(stack, dest_dev, dest_chdir)
+            if dest_workdirs is None:
+                return False
+
+        options = kwargs | {
+            "dest_dev": dest_dev,
+            "dest_command": dest_command,
+            "dest_chdir": dest_chdir,
+            "archive_dir": archive_dir,
+        }
+        jobs: dict[str, Job] = {
+            "snapshot": partial(snapshot_subvolumes, workdir, **options),
+            "remove": partial(remove_subvolumes, workdir, **options),
+        }
+        if dest_workdirs or dest_command or archive_dir:
+            jobs["upload"] = partial(
+                upload_snapshots, workdir, dest_workdirs=dest_workdirs, **options
+            )
+
+        export = partial(
+            export_metrics,
+            metrics,
+            json_path=metrics_json,
+            prometheus_path=metrics_prometheus,
+        )
+        jobs = {name: partial(run_job, name, job, export) for name, job in jobs.items()}
+
+        intervals = {
+            name: interval
+            for name, interval in [
+                ("snapshot", snapshot_interval),
+                ("upload", upload_interval),
+                ("remove", remove_interval),
+            ]
+            if interval is not None
+        }
+        if "upload" in intervals and "upload" not in jobs:
+            logger.error(
+                "Scheduling uploads requires --dest-dev, --dest-command or "
+                "--archive-dir."
+            )
+            return False
+
+        server = None
+        if socket_path:
+            server = stack.enter_context(socket(AF_UNIX, SOCK_STREAM))
+            socket_path.unlink(missing_ok=True)
+            server.bind(str(socket_path))
+            stack.callback(socket_path.unlink, missing_ok=True)
+            server.listen()
+            logger.info("Listening for jobs on %s", socket_path)
+
+        # Jobs report their own outcome, the daemon succeeds while it serves.
+        metrics.success = True
+
+        # Jobs still running hold the mounts, finish them before unmounting.
+        runner = JobRunner(jobs)
+        try:
+            serve(runner, intervals, server)
+        finally:
+            runner.join()
+
+    return True
+
+
+def add_arguments(parser: ArgumentParser) -> None:
+    parser.description = (
+        "Run jobs every given number of seconds and on demand. Writing a job "
+        "name followed by a newline to the socket runs it, the daemon replies "
+        "with ok or failed."
+    )
+
+    parser.add_argument(
+        "--socket",
+        dest="socket_path",
+        type=Path,
+        help="Unix socket to accept job names on.",
+    )
+    parser.add_argument(
+        "--snapshot-interval",
+        type=float,
+        help="Seconds between snapshot jobs.",
+    )
+    parser.add_argument(
+        "--upload-interval",
+        type=float,
+        help="Seconds between upload jobs.",
+    )
+    parser.add_argument(
+        "--remove-interval",
+        type=float,
+        help="Seconds between remove jobs.",
+    )
+    add_snapshot_arguments(parser)
+    add_upload_arguments(parser, required=False)
+    add_remove_arguments(parser)
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of logical directories to process concurrently.",
+    )
+    group = parser.add_mutually_exclusive_group()
+
+    group.add_argument(
+        "--include",
+        "-i",
+        type=str,
+        action="append",
+        help="Include only specified subvolumes.",
+    )
+    group.add_argument(
+        "--exclude",
+        "-e",
+        type=str,
+        action="append",
+        help="Include only subvolumes that were not specified.",
+    )
+
+    parser.set_defaults(func=run_daemon)
@@ -1,12 +1,26 @@
+import json
+import sys
+from argparse import ArgumentParser
 from collections.abc import Iterator
+from dataclasses import dataclass
 from enum import StrEnum
 from operator import attrgetter
 from pathlib import Path
 from typing import Any, Callable
 
-from btr_backup.common import include_exclude
+from btr_backup.catalog import snapshot_timestamp, snapshots_for
+from btr_backup.common import include_exclude, logical_directories
+from btr_backup.lock import locks
 from btr_backup.log import logger
-from btr_backup.protocols import Subparsers
+from btr_backup.metrics import metrics
+
+CADENCES = {
+    "hourly": 60 * 60,
+    "daily": 24 * 60 * 60,
+    "weekly": 7 * 24 * 60 * 60,
+    "monthly": 30 * 24 * 60 * 60,
+}
+CADENCE_TOLERANCE = 0.1
 
 
 class GraphElement(StrEnum):
@@ -16,6 +30,74 @@ class GraphElement(StrEnum):
     fork_right = "┣━━"
     turn_down = "━━┓"
     turn_right = "┗━━"
+    ellipsis = "…"
+
+
+class GraphFormat(StrEnum):
+    text = "text"
+    json = "json"
+    dot = "dot"
+
+
+@dataclass
+class Collapsed:
+    count: int
+    first: str
+    last: str
+
+    @property
+    def cadence(self) -> str | None:
+        start, end = snapshot_timestamp(self.first), snapshot_timestamp(self.last)
+        if start is None or end is None or self.count < 2:
+            return None
+
+        interval = (end - start) / (self.count - 1)
+        for name, seconds in CADENCES.items():
+            if abs(interval - seconds) <= seconds * CADENCE_TOLERANCE:
+                return name
+        return None
+
+    def __str__(self) -> str:
+        noun = "snapshot" if self.count == 1 else "snapshots"
+        if self.cadence:
+            noun = f"{self.cadence} {noun}"
+        return f"{GraphElement.ellipsis} {self.count:,} {noun} {GraphElement.ellipsis}"
+
+
+type Row = str | Collapsed
+
+
+def collapsed(snapshots: list[str]) -> list[Row]:
+    return [Collapsed(len(snapshots), snapshots[0], snapshots[-1])] if snapshots else []
+
+
+def directory_rows(
+    snapshots: list[str],
+    *,
+    collapse: int | None,
+    limit: int | None,
+) -> list[Row]:
+    """Rows of oldest to newest snapshots with hidden runs collapsed.
+
+    Snapshots older than the newest limit ones form a single row, as do the
+    ones between the collapse oldest and collapse newest of the rest.
+    """
+    rows: list[Row] = []
+
+    if limit is not None and len(snapshots) > limit:
+        split = len(snapshots) - limit
+        rows += collapsed(snapshots[:split])
+        snapshots = snapshots[split:]
+
+    if collapse is not None and len(snapshots) > 2 * collapse + 1:
+        split = len(snapshots) - collapse
+        rows += snapshots[:collapse]
+        rows += collapsed(snapshots[collapse:split])
+        rows += snapshots[split:]
+    else:
+        rows += snapshots
+
+    return rows
 
 
 def generate_with_last[T, U](
@@ -23,40 +105,44 @@ def generate_with_last[T, U](
     producer: Callable[[T], Iterator[U]],
     last_producer: Callable[[T], Iterator[U]],
 ) -> Iterator[U]:
+    if not values:
+        return
+
     for value in values[:-1]:
         yield from producer(value)
     yield from last_producer(values[-1])
 
 
 def generate_subvolume_graph(
-    subvolumes: list[str],
+    rows: list[Row],
     padding: int,
     last: bool = False,
 ) -> Iterator[str]:
-    def generator(subvolume: str) -> Iterator[str]:
+    def generator(row: Row) -> Iterator[str]:
         yield GraphElement.trunk if not last else GraphElement.whitespace
         yield GraphElement.whitespace * padding
         yield GraphElement.fork_right
         yield GraphElement.whitespace
-        yield subvolume
+        yield str(row)
         yield GraphElement.newline
 
-    def last_generator(subvolume: str) -> Iterator[str]:
+    def last_generator(row: Row) -> Iterator[str]:
         yield GraphElement.trunk if not last else GraphElement.whitespace
         yield GraphElement.whitespace * padding
         yield GraphElement.turn_right
         yield GraphElement.whitespace
-        yield subvolume
+        yield str(row)
         yield GraphElement.newline
 
-    yield from generate_with_last(subvolumes, generator, last_generator)
-
+    yield from generate_with_last(rows, generator, last_generator)
 
-def generate_graph(logical_dirs: dict[str, list[str]]) -> Iterator[str]:
-    items = list(logical_dirs.items())
 
-    def generator(item: tuple[str, list[str]]) -> Iterator[str]:
-        logic_dir, subvolumes = item
+def generate_graph(
+    directories: list[Path],
+    rows_for: Callable[[Path], list[Row]] | None,
+) -> Iterator[str]:
+    def generator(directory: Path, last: bool = False) -> Iterator[str]:
+        logic_dir = directory.name
 
         padding = (
             len(GraphElement.fork_right)
@@ -71,41 +157,88 @@ def generate_graph(logical_dirs: dict[str, list[str]]) -> Iterator[str]:
         yield GraphElement.trunk
         yield GraphElement.newline
 
-        yield GraphElement.fork_right
+        yield GraphElement.fork_right if not last else GraphElement.turn_right
         yield GraphElement.whitespace
         yield logic_dir
+
+        if rows_for is None:
+            yield GraphElement.newline
+            return
+
         yield GraphElement.whitespace
         yield GraphElement.turn_down
         yield GraphElement.newline
 
-        yield from generate_subvolume_graph(subvolumes, padding)
+        yield from generate_subvolume_graph(rows_for(directory), padding, last=last)
 
-    def last_generator(item: tuple[str, list[str]]) -> Iterator[str]:
-        logic_dir, subvolumes = item
+    def last_generator(directory: Path) -> Iterator[str]:
+        yield from generator(directory, last=True)
 
-        padding = (
-            len(GraphElement.fork_right)
-            + len(GraphElement.whitespace)
-            + len(logic_dir)
-            + len(GraphElement.whitespace)
-            + len(GraphElement.turn_down)
-            - 1  # no trunk
-            - 1  # start at the same column
-        )
+    yield from generate_with_last(directories, generator, last_generator)
 
-        yield GraphElement.trunk
-        yield GraphElement.newline
 
-        yield GraphElement.turn_right
-        yield GraphElement.whitespace
-        yield logic_dir
-        yield GraphElement.whitespace
-        yield GraphElement.turn_down
-        yield GraphElement.newline
+def json_row(row: Row) -> str | dict[str, Any]:
+    if isinstance(row, str):
+        return row
+
+    return {
+        "collapsed": row.count,
+        "first": row.first,
+        "last": row.last,
+        "cadence": row.cadence,
+    }
+
+
+def generate_json(
+    directories: list[Path],
+    rows_for: Callable[[Path], list[Row]] | None,
+) -> Iterator[str]:
+    yield "["
+
+    for index, directory in enumerate(directories):
+        element: dict[str, Any] = {"name": directory.name}
+        if rows_for is not None:
+            element["snapshots"] = [json_row(row) for row in rows_for(directory)]
+
+        yield "," if index else ""
+        yield "\n  "
+        yield json.dumps(element, ensure_ascii=False)
+
+    yield "\n]\n"
 
-        yield from generate_subvolume_graph(subvolumes, padding, last=True)
 
-    yield from generate_with_last(items, generator, last_generator)
+def dot_id(value: str) -> str:
+    # JSON string escapes are valid in DOT quoted identifiers.
+    return json.dumps(value, ensure_ascii=False)
+
+
+def generate_dot(
+    directories: list[Path],
+    rows_for: Callable[[Path], list[Row]] | None,
+) -> Iterator[str]:
+    yield "digraph snapshots {\n"
+    yield "  rankdir=LR;\n"
+    yield "  node [shape=box];\n"
+
+    for directory in directories:
+        previous = dot_id(directory.name)
+        yield f"  {previous} [shape=folder];\n"
+
+        for index, row in enumerate(rows_for(directory) if rows_for else []):
+            node = dot_id(f"{directory.name}/{index}")
+            style = "" if isinstance(row, str) else ", style=dashed"
+            yield f"  {node} [label={dot_id(str(row))}{style}];\n"
+            yield f"  {previous} -> {node};\n"
+            previous = node
+
+    yield "}\n"
+
+
+GENERATORS = {
+    GraphFormat.text: generate_graph,
+    GraphFormat.json: generate_json,
+    GraphFormat.dot: generate_dot,
+}
 
 
 def graph_subvolumes(
@@ -113,35 +246,68 @@ def graph_subvolumes(
     *,
     include: list[str],
     exclude: list[str],
+    format: GraphFormat,
+    depth: int,
+    collapse: int | None,
+    limit: int | None,
     **kwargs: Any,
 ) -> bool:
-    logger.debug(f"Graphing subvolumes in {workdir}")
-
-    directories = include_exclude(
-        workdir.iterdir(),
-        include,
-        exclude,
-        attrgetter("name"),
-    )
-    logger.debug(f"Found subvolume directories: {', '.join(map(str, directories))}")
+    logger.debug("Graphing subvolumes in %s", workdir)
+
+    with metrics.measure("enumerate"):
+        directories = include_exclude(
+            logical_directories(workdir),
+            include,
+            exclude,
+            attrgetter("name"),
+        )
+    logger.debug("Found subvolume directories: %s", ", ".join(map(str, directories)))
 
-    structure = {
-        subvol_dir.name: sorted(subvol.name for subvol in subvol_dir.iterdir())
-        for subvol_dir in directories
-    }
-    logger.debug(f"Subvolume structure: {structure}")
+    def rows_for(directory: Path) -> list[Row]:
+        with locks.hold(directory, exclusive=False) as held:
+            # The catalog lists snapshots newest first.
+            snapshots = snapshots_for(directory)[::-1] if held else []
+            active = ["active"] if held and (directory / "active").exists() else []
+        # The active subvolume sorts after every snapshot name, as it did when
+        # directories were listed whole.
+        return directory_rows(snapshots, collapse=collapse, limit=limit) + active
 
-    print("".join(generate_graph(structure)))
+    # Written as generated, one directory listing in memory at a time.
+    generate = GENERATORS[format]
+    sys.stdout.writelines(generate(directories, rows_for if depth > 1 else None))
 
     return True
 
 
-def add_command(subparsers: Subparsers) -> None:
-    parser = subparsers.add_parser(
-        "graph",
-        help="Graph available subvolumes.",
+def add_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--format",
+        type=GraphFormat,
+        choices=list(GraphFormat),
+        default=GraphFormat.text,
+        help="Output format, json and dot are meant for other tools.",
+    )
+    parser.add_argument(
+        "--depth",
+        type=int,
+        choices=[1, 2],
+        default=2,
+        help="Show only directories with 1, or also their snapshots with 2.",
+    )
+    parser.add_argument(
+        "--collapse",
+        type=int,
+        metavar="N",
+        help="Show only the N oldest and N newest snapshots of a directory and "
+        "collapse the run between them into one line.",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        metavar="N",
+        help="Show only the N newest snapshots of a directory and collapse the "
+        "older ones into one line.",
     )
-
     group = parser.add_mutually_exclusive_group()
 
     group.add_argument(
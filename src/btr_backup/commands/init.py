@@ -1,13 +1,10 @@
-from os import fspath
+from argparse import ArgumentParser
 from pathlib import Path
 from tempfile import mkdtemp
 from typing import Any
 
-from btrfsutil import create_subvolume, subvolume_id
-from mount import mount
-
+from btr_backup.backend import backend
 from btr_backup.log import logger
-from btr_backup.protocols import Subparsers
 
 
 def init(
@@ -29,7 +26,7 @@ def init(
     directory_path.mkdir()
 
     active_subvolume_path = directory_path / "active"
-    create_subvolume(active_subvolume_path)
+    backend.create_subvolume(active_subvolume_path)
 
     logger.info("Logical directory %s initialized successfully.", directory_path)
 
@@ -43,11 +40,11 @@ def init(
 
     mount_dir.mkdir(exist_ok=True, parents=True)
 
-    subvolid = subvolume_id(active_subvolume_path)
+    subvolid = backend.subvolume_id(active_subvolume_path)
     logger.debug("Subvolume ID for %s is %d", directory_path, subvolid)
 
     try:
-        mount(fspath(dev), fspath(mount_dir), "btrfs", data=f"subvolid={subvolid}")
+        backend.mount(dev, mount_dir, "btrfs", data=f"subvolid={subvolid}")
     except OSError as e:
         logger.error("Failed to mount logical directory: %s", e)
         return False
@@ -59,12 +56,7 @@ def init(
     return True
 
 
-def add_command(subparsers: Subparsers) -> None:
-    parser = subparsers.add_parser(
-        "init",
-        help="Initialize a logical directory for subvolumes.",
-    )
-
+def add_arguments(parser: ArgumentParser) -> None:
     parser.add_argument(
         "dir",
         type=str,
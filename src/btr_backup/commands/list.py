@@ -1,11 +1,84 @@
-from argparse import BooleanOptionalAction
+import json
+import sys
+from argparse import ArgumentParser, BooleanOptionalAction
+from enum import StrEnum
 from operator import attrgetter
 from pathlib import Path
 from typing import Any
 
-from btr_backup.common import include_exclude, snapshots_for
+from btr_backup.backend import backend
+from btr_backup.btrfs import subvolume_root
+from btr_backup.catalog import snapshots_for
+from btr_backup.common import format_size, include_exclude, logical_directories
+from btr_backup.lock import locks
 from btr_backup.log import logger
-from btr_backup.protocols import Subparsers
+from btr_backup.metrics import metrics
+
+type Usage = tuple[int, int] | None
+
+
+class ListFormat(StrEnum):
+    text = "text"
+    jsonl = "jsonl"
+
+
+def usage_columns(usage: Usage) -> list[str]:
+    return [format_size(size) for size in usage] if usage else ["-", "-"]
+
+
+def usage_fields(usage: Usage) -> dict[str, int | None]:
+    referenced, exclusive = usage or (None, None)
+    return {"referenced": referenced, "exclusive": exclusive}
+
+
+def list_directory(
+    directory: Path,
+    quotas: dict[Path, tuple[int, int]] | None,
+    *,
+    format: ListFormat,
+    count: bool,
+    show: bool,
+) -> None:
+    snapshots = snapshots_for(directory)
+
+    usages: dict[str, Usage] = {}
+    total: Usage = None
+    if quotas is not None:
+        usages = {name: quotas.get(directory / name) for name in snapshots}
+        # Snapshots share most of what they reference, so a directory shows
+        # what its newest snapshot references. Exclusive bytes add up to what
+        # removing every snapshot frees, data shared between them is not counted.
+        newest = usages[snapshots[0]] if snapshots else None
+        if newest:
+            exclusive = sum(usage[1] for usage in usages.values() if usage)
+            total = newest[0], exclusive
+
+    match format:
+        case ListFormat.jsonl:
+            record: dict[str, Any] = {"directory": directory.name}
+            if count:
+                record["count"] = len(snapshots)
+            if quotas is not None:
+                record |= usage_fields(total)
+            print(json.dumps(record))
+
+            for name in snapshots if show else []:
+                record = {"directory": directory.name, "snapshot": name}
+                if quotas is not None:
+                    record |= usage_fields(usages[name])
+                print(json.dumps(record))
+
+        case ListFormat.text:
+            columns = [directory.name, str(len(snapshots)) if count else ""]
+            if quotas is not None:
+                columns += usage_columns(total)
+            print(*columns, sep="\t")
+
+            for name in snapshots if show else []:
+                columns = ["", name]
+                if quotas is not None:
+                    columns += usage_columns(usages[name])
+                print(*columns, sep="\t")
 
 
 def list_subvolumes(
@@ -15,41 +88,53 @@ def list_subvolumes(
     exclude: list[str],
     count: bool,
     show: bool,
+    space: bool,
+    format: ListFormat,
     **kwargs: Any,
 ) -> bool:
     logger.debug("Listing subvolumes in %s", workdir)
 
-    directories = include_exclude(
-        workdir.iterdir(),
-        include,
-        exclude,
-        attrgetter("name"),
-    )
-    snapshots = {
-        subvolume_dir.name: snapshots_for(subvolume_dir)
-        for subvolume_dir in directories
-    }
+    with metrics.measure("enumerate"):
+        directories = include_exclude(
+            logical_directories(workdir),
+            include,
+            exclude,
+            attrgetter("name"),
+        )
 
-    if not snapshots:
+    if not directories:
         logger.error("No directories found.")
         return False
 
-    for directory, snapshot_list in snapshots.items():
-        print(f"{directory}", end="\t")
-        print(len(snapshot_list) if count else "")
+    quotas = None
+    if space:
+        try:
+            with metrics.measure("qgroups"):
+                usage = backend.qgroup_usage(workdir)
+        except OSError as e:
+            logger.error("Reading quota groups failed, are quotas enabled? %s", e)
+            return False
 
-        for snapshot in snapshot_list if show else []:
-            print(f"\t{snapshot}")
+        # Quota groups are named by subvolume id, a single tree search maps
+        # every snapshot to its id instead of a lookup per snapshot.
+        root = subvolume_root(workdir)
+        quotas = {
+            root / path: usage[id]
+            for path, id in backend.iterate_subvolumes(root)
+            if id in usage
+        }
 
-    return True
+    # Directories are printed as they are enumerated, not collected first.
+    for directory in directories:
+        with locks.hold(directory, exclusive=False) as held:
+            if held:
+                list_directory(directory, quotas, format=format, count=count, show=show)
+        sys.stdout.flush()
 
+    return True
 
-def add_command(subparsers: Subparsers) -> None:
-    parser = subparsers.add_parser(
-        "list",
-        help="List available subvolumes.",
-    )
 
+def add_arguments(parser: ArgumentParser) -> None:
     parser.add_argument(
         "--count",
         action=BooleanOptionalAction,
@@ -62,6 +147,21 @@ def add_command(subparsers: Subparsers) -> None:
         default=False,
         help="Show snapshots.",
     )
+    parser.add_argument(
+        "--space",
+        action=BooleanOptionalAction,
+        default=False,
+        help="Show referenced and exclusive bytes from quota groups, directories "
+        "show the bytes referenced by their newest snapshot and the exclusive "
+        "bytes of all their snapshots.",
+    )
+    parser.add_argument(
+        "--format",
+        type=ListFormat,
+        choices=list(ListFormat),
+        default=ListFormat.text,
+        help="Output format, jsonl prints one JSON record per line.",
+    )
     group = parser.add_mutually_exclusive_group()
 
     group.add_argument(
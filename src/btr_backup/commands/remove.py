@@ -1,13 +1,92 @@
-from itertools import chain
+from argparse import ArgumentParser, BooleanOptionalAction
+from concurrent.futures import ThreadPoolExecutor
 from operator import attrgetter
 from pathlib import Path
+from time import sleep
 from typing import Any
 
-from btrfsutil import delete_subvolume
+from btr_backup.backend import backend
+from btr_backup.catalog import snapshot_info, snapshot_removed, snapshots_for
+from btr_backup.common import include_exclude, logical_directories
+from btr_backup.lock import locks
+from btr_backup.log import log_fields, logger
+from btr_backup.metrics import metrics
+from btr_backup.state import forget_stream, uploaded_snapshots
 
-from btr_backup.common import include_exclude, snapshots_for
-from btr_backup.log import logger
-from btr_backup.protocols import Subparsers
+WAIT_INTERVAL = 1.0
+
+
+def remove_snapshots(
+    directory: Path,
+    snapshots: list[str],
+    *,
+    dry_run: bool,
+) -> set[int]:
+    removed = set()
+
+    # Read every id from the listing validated before the first delete, which
+    # changes the directory and makes the next read list it again.
+    ids = {}
+    if not dry_run:
+        ids = {name: snapshot_info(directory / name)["id"] for name in snapshots}
+
+    for name in snapshots:
+        with log_fields(directory=directory.name, snapshot=name):
+            snapshot = directory / name
+            logger.info("%s/%s will be removed", directory.name, name)
+
+            if dry_run:
+                continue
+
+            removed.add(ids[name])
+            with metrics.measure("delete", directory.name):
+                backend.delete_subvolume(snapshot)
+            snapshot_removed(snapshot)
+            forget_stream(directory.parent, directory.name, name)
+
+    return removed
+
+
+def expired_snapshots(
+    directory: Path,
+    keep_latest: int,
+    *,
+    keep_uploaded: bool,
+) -> list[str]:
+    expired = snapshots_for(directory)[keep_latest:]
+    if not keep_uploaded:
+        return expired
+
+    uploaded = uploaded_snapshots(directory.parent, directory.name)
+    for name in uploaded.keys() & set(expired):
+        logger.info(
+            "Keeping %s/%s, latest snapshot uploaded to %s",
+            directory.name,
+            name,
+            uploaded[name],
+        )
+
+    return [name for name in expired if name not in uploaded]
+
+
+def wait_for_cleaner(workdir: Path, removed: set[int]) -> None:
+    # Deleted subvolumes are only handed to the cleaner once the transaction
+    # that deleted them is committed.
+    backend.sync(workdir)
+
+    cleaned = -1
+    with metrics.measure("clean"):
+        while pending := removed & set(backend.deleted_subvolumes(workdir)):
+            if cleaned != len(removed) - len(pending):
+                cleaned = len(removed) - len(pending)
+                logger.info(
+                    "Waiting for btrfs cleaner, %d of %d subvolumes cleaned.",
+                    cleaned,
+                    len(removed),
+                )
+            sleep(WAIT_INTERVAL)
+
+    logger.info("btrfs cleaner removed all %d subvolumes.", len(removed))
 
 
 def remove_subvolumes(
@@ -17,44 +96,67 @@ def remove_subvolumes(
     exclude: list[str],
     dry_run: bool,
     keep_latest: int,
+    jobs: int,
+    wait: bool,
+    keep_uploaded: bool,
     **kwargs: Any,
 ) -> bool:
     logger.debug("Looking up subvolumes in %s", workdir)
 
-    directories = include_exclude(
-        workdir.iterdir(),
-        include,
-        exclude,
-        attrgetter("name"),
-    )
+    with metrics.measure("enumerate"):
+        directories = include_exclude(
+            logical_directories(workdir),
+            include,
+            exclude,
+            attrgetter("name"),
+        )
 
     if not directories:
         logger.error("No specified directories found.")
         return False
 
-    to_remove = (
-        (
-            subvolume_dir / snapshot
-            for snapshot in snapshots_for(subvolume_dir)[keep_latest:]
-        )
-        for subvolume_dir in directories
-    )
+    def remove(directory: Path) -> set[int]:
+        # A dry run changes nothing, reading the directory is enough.
+        with locks.hold(directory, exclusive=not dry_run) as held:
+            if not held:
+                return set()
 
-    for snapshot in chain.from_iterable(to_remove):
-        logger.info("%s will be removed", snapshot.relative_to(workdir))
+            return remove_snapshots(
+                directory,
+                expired_snapshots(directory, keep_latest, keep_uploaded=keep_uploaded),
+                dry_run=dry_run,
+            )
 
-        if not dry_run:
-            delete_subvolume(snapshot)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            directory.name: executor.submit(remove, directory)
+            for directory in directories
+        }
 
-    return True
+    removed: set[int] = set()
+    failed = []
 
+    for name, future in futures.items():
+        try:
+            removed |= future.result()
+        except OSError as e:
+            logger.error("Removing snapshots from %s failed: %s", name, e)
+            failed.append(name)
+        except Exception:
+            # A bug in one directory must not hide the outcome of the others.
+            logger.exception("Removing snapshots from %s failed.", name)
+            failed.append(name)
 
-def add_command(subparsers: Subparsers) -> None:
-    parser = subparsers.add_parser(
-        "remove",
-        help="Remove selected subvolumes.",
-    )
+    if failed:
+        logger.error("Failed to remove snapshots from: %s", ", ".join(failed))
 
+    if wait and removed:
+        wait_for_cleaner(workdir, removed)
+
+    return not failed
+
+
+def add_remove_arguments(parser: ArgumentParser) -> None:
     parser.add_argument(
         "--dry-run",
         "-n",
@@ -68,6 +170,29 @@ def add_command(subparsers: Subparsers) -> None:
         default=1,
         help="Number of latest subvolumes to keep.",
     )
+    parser.add_argument(
+        "--wait",
+        action=BooleanOptionalAction,
+        default=False,
+        help="Wait until btrfs cleaner reclaimed the space of removed snapshots.",
+    )
+    parser.add_argument(
+        "--keep-uploaded",
+        action=BooleanOptionalAction,
+        default=False,
+        help="Keep the latest snapshot uploaded to each destination.",
+    )
+
+
+def add_arguments(parser: ArgumentParser) -> None:
+    add_remove_arguments(parser)
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of logical directories to remove snapshots from concurrently.",
+    )
     group = parser.add_mutually_exclusive_group()
 
     group.add_argument(
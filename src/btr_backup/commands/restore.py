@@ -0,0 +1,183 @@
+from argparse import ArgumentParser
+from operator import attrgetter
+from pathlib import Path
+from typing import Any
+
+from btr_backup.archive import Manifest, chunk_store, load_manifests, restore_stream
+from btr_backup.backend import backend
+from btr_backup.btrfs import remove_partial, send_uuid
+from btr_backup.catalog import snapshot_added, snapshots_for
+from btr_backup.common import include_exclude, logical_directories
+from btr_backup.lock import locks
+from btr_backup.log import logger
+from btr_backup.metrics import metrics
+
+
+def restore_chain(
+    manifests: dict[str, Manifest],
+    target: str,
+    present: set[bytes],
+) -> list[str]:
+    by_uuid = {manifest["uuid"]: name for name, manifest in manifests.items()}
+
+    chain = []
+    uuid: str | None = manifests[target]["uuid"]
+    while uuid is not None and bytes.fromhex(uuid) not in present:
+        if uuid not in by_uuid:
+            raise ValueError(f"Parent {uuid} of {chain[-1]} is not archived.")
+
+        chain.append(by_uuid[uuid])
+        uuid = manifests[chain[-1]]["parent_uuid"]
+
+    return chain[::-1]
+
+
+def restore_snapshot(store: Path, manifest: Manifest, destination: Path) -> bool:
+    with backend.receive(destination) as receive:
+        assert receive.stdin is not None
+
+        try:
+            with metrics.measure("restore", destination.name) as measurement:
+                measurement.bytes = restore_stream(
+                    store, manifest, receive.stdin.fileno()
+                )
+        except BrokenPipeError:
+            receive.wait()
+            logger.error("Receiving snapshot into %s failed.", destination)
+            return False
+        except ValueError as e:
+            receive.kill()
+            logger.error("Failed to read archived snapshot: %s", e)
+            return False
+
+        receive.stdin.close()
+
+        if receive.wait() != 0:
+            logger.error("Receiving snapshot into %s failed.", destination)
+            return False
+
+    return True
+
+
+def restore_directory(
+    archive: Path,
+    destination: Path,
+    *,
+    store: Path,
+    snapshot: str | None,
+) -> bool:
+    logger.debug("Restoring archived directory %s", archive)
+
+    manifests = load_manifests(archive)
+    if not manifests:
+        logger.warning("No archived snapshots found in %s, skipping.", archive)
+        return True
+
+    target = snapshot or max(manifests)
+    if target not in manifests:
+        logger.error("Snapshot %s is not archived in %s.", target, archive)
+        return False
+
+    destination.mkdir(exist_ok=True)
+
+    present = {send_uuid(destination / name) for name in snapshots_for(destination)}
+
+    try:
+        chain = restore_chain(manifests, target, present)
+    except ValueError as e:
+        logger.error("Cannot restore %s from %s: %s", target, archive, e)
+        return False
+
+    if not chain:
+        logger.warning("Snapshot %s is already present, skipping.", target)
+        return True
+
+    for name in chain:
+        logger.info("Restoring snapshot %s/%s", archive.name, name)
+
+        if not restore_snapshot(store, manifests[name], destination):
+            remove_partial(destination / name)
+            return False
+
+        snapshot_added(destination / name)
+
+    return True
+
+
+def restore_snapshots(
+    workdir: Path,
+    *,
+    include: list[str],
+    exclude: list[str],
+    archive_dir: Path,
+    snapshot: str | None,
+    **kwargs: Any,
+) -> bool:
+    if not backend.progs_available():
+        logger.error("btrfs-progs not available.")
+        return False
+
+    if not archive_dir.is_dir():
+        logger.error("Archive directory %s does not exist.", archive_dir)
+        return False
+
+    with metrics.measure("enumerate"):
+        directories = include_exclude(
+            logical_directories(archive_dir),
+            include,
+            exclude,
+            attrgetter("name"),
+        )
+
+    if not directories:
+        logger.error("No specified directories found.")
+        return False
+
+    store = chunk_store(archive_dir)
+
+    def restore(directory: Path) -> bool:
+        destination = workdir / directory.name
+        with locks.hold(destination, exclusive=True) as held:
+            if not held:
+                return True
+
+            return restore_directory(
+                directory,
+                destination,
+                store=store,
+                snapshot=snapshot,
+            )
+
+    return all([restore(directory) for directory in directories])
+
+
+def add_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--archive-dir",
+        type=Path,
+        required=True,
+        help="Directory the snapshots were archived to.",
+    )
+    parser.add_argument(
+        "--snapshot",
+        type=str,
+        help="Name of the snapshot to restore, defaults to the latest one.",
+    )
+    group = parser.add_mutually_exclusive_group()
+
+    group.add_argument(
+        "--include",
+        "-i",
+        type=str,
+        action="append",
+        help="Include only specified subvolumes.",
+    )
+    group.add_argument(
+        "--exclude",
+        "-e",
+        type=str,
+        action="append",
+        help="Include only subvolumes that were not specified.",
+    )
+
+    parser.set_defaults(func=restore_snapshots)
@@ -0,0 +1,112 @@
+from argparse import ArgumentParser
+from collections.abc import Callable
+from contextlib import ExitStack
+from functools import partial
+from pathlib import Path
+from typing import Any
+
+from btr_backup.commands.check import check_structure
+from btr_backup.commands.remove import add_remove_arguments, remove_subvolumes
+from btr_backup.commands.snapshot import add_snapshot_arguments, snapshot_subvolumes
+from btr_backup.commands.upload import (
+    add_upload_arguments,
+    mount_destinations,
+    upload_snapshots,
+)
+from btr_backup.log import logger
+
+STAGES = ["check", "check-destination", "snapshot", "upload", "remove"]
+
+
+def check_destinations(dest_workdirs: list[Path], **kwargs: Any) -> bool:
+    # Check every destination, not only up to the first broken one.
+    return all([check_structure(workdir, **kwargs) for workdir in dest_workdirs])
+
+
+def run_stages(
+    workdir: Path,
+    *,
+    stages: list[str],
+    dest_dev: list[Path] | None,
+    dest_command: list[list[str]] | None,
+    dest_chdir: Path,
+    archive_dir: Path | None,
+    **kwargs: Any,
+) -> bool:
+    options = kwargs | {
+        "dest_dev": dest_dev,
+        "dest_command": dest_command,
+        "dest_chdir": dest_chdir,
+        "archive_dir": archive_dir,
+    }
+
+    if "check-destination" in stages and dest_dev is None:
+        logger.error("Stage check-destination requires --dest-dev.")
+        return False
+
+    if "upload" in stages and not (dest_dev or dest_command or archive_dir):
+        logger.error(
+            "Stage upload requires --dest-dev, --dest-command or --archive-dir."
+        )
+        return False
+
+    with ExitStack() as stack:
+        dest_workdirs = None
+        if dest_dev and ("check-destination" in stages or "upload" in stages):
+            dest_workdirs = mount_destinations(stack, dest_dev, dest_chdir)
+            if dest_workdirs is None:
+                return False
+
+        commands: dict[str, Callable[..., bool]] = {
+            "check": partial(check_structure, workdir),
+            "check-destination": partial(check_destinations, dest_workdirs or []),
+            "snapshot": partial(snapshot_subvolumes, workdir),
+            "upload": partial(upload_snapshots, workdir, dest_workdirs=dest_workdirs),
+            "remove": partial(remove_subvolumes, workdir),
+        }
+
+        for stage in stages:
+            logger.info("Running %s stage.", stage)
+
+            if not commands[stage](**options):
+                logger.error("Stage %s failed, skipping the remaining stages.", stage)
+                return False
+
+    return True
+
+
+def add_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "stages",
+        nargs="+",
+        choices=STAGES,
+        help="Commands to run, stops at the first one that fails.",
+    )
+    add_snapshot_arguments(parser)
+    add_upload_arguments(parser, required=False)
+    add_remove_arguments(parser)
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of logical directories to process concurrently.",
+    )
+    group = parser.add_mutually_exclusive_group()
+
+    group.add_argument(
+        "--include",
+        "-i",
+        type=str,
+        action="append",
+        help="Include only specified subvolumes.",
+    )
+    group.add_argument(
+        "--exclude",
+        "-e",
+        type=str,
+        action="append",
+        help="Include only subvolumes that were not specified.",
+    )
+
+    parser.set_defaults(func=run_stages)
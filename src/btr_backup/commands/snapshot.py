@@ -1,66 +1,167 @@
+from argparse import ArgumentParser, BooleanOptionalAction
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from datetime import datetime
 from operator import attrgetter
 from pathlib import Path
+from threading import Barrier
+from time import perf_counter
 from typing import Any
 
-from btrfsutil import create_snapshot, is_subvolume
-
-from btr_backup.common import include_exclude
+from btr_backup.backend import backend
+from btr_backup.catalog import snapshot_added
+from btr_backup.common import include_exclude, logical_directories
+from btr_backup.lock import locks
 from btr_backup.log import logger
-from btr_backup.protocols import Subparsers
+from btr_backup.metrics import metrics
 
 
-def snapshot_subvolumes(
-    workdir: Path,
-    *,
-    include: list[str],
-    exclude: list[str],
-    **kwargs: Any,
-) -> bool:
-    logger.debug("Creating snapshots for subvolumes in %s", workdir)
+def timed_snapshot(barrier: Barrier, source: Path, destination: Path) -> float:
+    barrier.wait()
+    with metrics.measure("snapshot", source.parent.name):
+        backend.create_snapshot(source, destination, read_only=True)
+    return perf_counter()
+
 
-    direcotries = include_exclude(
-        workdir.iterdir(),
-        include,
-        exclude,
-        attrgetter("name"),
+def create_group_snapshot(workdir: Path, pairs: list[tuple[Path, Path]]) -> bool:
+    """Snapshot subvolumes concurrently so that btrfs can commit them together.
+
+    The window from issuing the snapshots until the last one completed bounds
+    the spread between their points in time, it is logged and recorded as the
+    snapshot_window phase.
+    """
+    logger.info(
+        "Creating group snapshot %s of %s",
+        pairs[0][1].name,
+        ", ".join(source.parent.name for source, _ in pairs),
     )
 
-    if not direcotries:
-        logger.error("No specified directories found.")
-        return False
+    barrier = Barrier(len(pairs) + 1)
+    failed = []
+    finished = []
+
+    with ThreadPoolExecutor(max_workers=len(pairs)) as executor:
+        futures = {
+            destination: executor.submit(timed_snapshot, barrier, source, destination)
+            for source, destination in pairs
+        }
+        barrier.wait()
+        start = perf_counter()
+
+    for destination, future in futures.items():
+        try:
+            finished.append(future.result())
+        except OSError as e:
+            logger.error("Failed to create snapshot %s: %s", destination, e)
+            failed.append(destination)
+        except Exception:
+            # A bug in one snapshot must not hide the outcome of the others.
+            logger.exception("Failed to create snapshot %s.", destination)
+            failed.append(destination)
+        else:
+            snapshot_added(destination)
+
+    if finished:
+        window = max(finished) - start
+        metrics.record("snapshot_window", duration=window)
+        logger.info(
+            "Group snapshot of %d subvolumes taken within %.3f seconds.",
+            len(finished),
+            window,
+        )
+
+    if failed:
+        logger.error(
+            "Group snapshot is incomplete, failed: %s",
+            ", ".join(str(path.relative_to(workdir)) for path in failed),
+        )
+
+    return not failed
+
 
-    active = [directory / "active" for directory in direcotries]
+def snapshot_directories(
+    workdir: Path,
+    directories: list[Path],
+    *,
+    group: bool,
+) -> bool:
+    active = [directory / "active" for directory in directories]
 
-    if not all(is_subvolume(path) for path in active):
+    if not all(backend.is_subvolume(path) for path in active):
         logger.error("Some active subvolumes are missing.")
         return False
 
     snapshot_name = datetime.now().astimezone().strftime("%Y-%m-%dT%H:%M:%S%:z")
 
-    snapshots = [directory / snapshot_name for directory in direcotries]
+    snapshots = [directory / snapshot_name for directory in directories]
 
     if not all(not path.exists() for path in snapshots):
         logger.error("Some snapshots already exist.")
         return False
 
+    if group:
+        return create_group_snapshot(workdir, list(zip(active, snapshots)))
+
     for source, destination in zip(active, snapshots):
         logger.info(
             "Creating snapshot %s from %s",
             destination.relative_to(workdir),
             source.relative_to(workdir),
         )
-        create_snapshot(source, destination, read_only=True)
+        with metrics.measure("snapshot", source.parent.name):
+            backend.create_snapshot(source, destination, read_only=True)
+        snapshot_added(destination)
 
     return True
 
 
-def add_command(subparsers: Subparsers) -> None:
-    parser = subparsers.add_parser(
-        "snapshot",
-        help="Snapshot selected subvolumes.",
+def snapshot_subvolumes(
+    workdir: Path,
+    *,
+    include: list[str],
+    exclude: list[str],
+    group: bool,
+    **kwargs: Any,
+) -> bool:
+    logger.debug("Creating snapshots for subvolumes in %s", workdir)
+
+    with metrics.measure("enumerate"):
+        directories = include_exclude(
+            logical_directories(workdir),
+            include,
+            exclude,
+            attrgetter("name"),
+        )
+
+    if not directories:
+        logger.error("No specified directories found.")
+        return False
+
+    with ExitStack() as stack:
+        # Locked in name order, so that two group snapshots cannot deadlock.
+        held = {
+            directory
+            for directory in sorted(directories)
+            if stack.enter_context(locks.hold(directory, exclusive=True))
+        }
+        directories = [directory for directory in directories if directory in held]
+        if not directories:
+            return True
+
+        return snapshot_directories(workdir, directories, group=group)
+
+
+def add_snapshot_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--group",
+        action=BooleanOptionalAction,
+        default=False,
+        help="Snapshot all subvolumes concurrently, as close to one point in time.",
     )
 
+
+def add_arguments(parser: ArgumentParser) -> None:
+    add_snapshot_arguments(parser)
     group = parser.add_mutually_exclusive_group()
 
     group.add_argument(
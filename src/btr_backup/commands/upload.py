@@ -1,148 +1,861 @@
+import shlex
+from argparse import ArgumentParser, BooleanOptionalAction
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import ExitStack
+from functools import partial
+from hashlib import sha256
+from itertools import takewhile
 from operator import attrgetter
-from pathlib import Path
-from subprocess import DEVNULL, run
-from tempfile import TemporaryDirectory, TemporaryFile
-from typing import IO, Any
-
+from pathlib import Path, PurePosixPath
+from shutil import rmtree
+from tempfile import TemporaryDirectory
+from typing import Any
+
+from btr_backup.archive import (
+    COMPRESSION,
+    Manifest,
+    archive_stream,
+    chunk_store,
+    load_manifests,
+    write_manifest,
+)
+from btr_backup.backend import backend
+from btr_backup.btrfs import send_uuid
+from btr_backup.catalog import catalog_for, snapshots_for
+from btr_backup.checkpoint import (
+    DEFAULT_CHECKPOINT_SIZE,
+    checkpoint_stream,
+    checkpointed_chunks,
+    complete_checkpoint,
+    load_progress,
+    prune_staging,
+    staging_directory,
+)
 from btr_backup.common import (
     block_device,
+    byte_size,
+    format_size,
     include_exclude,
-    mount_context,
-    snapshots_for,
+    logical_directories,
+)
+from btr_backup.estimate import estimate_send_size, makespan
+from btr_backup.integrity import verify_directories
+from btr_backup.lock import locks
+from btr_backup.log import log_fields, logger
+from btr_backup.metrics import metrics
+from btr_backup.session import mount_context
+from btr_backup.state import StreamRecord, record_stream, record_upload
+from btr_backup.stream import (
+    DEFAULT_BUFFER_SIZE,
+    DEFAULT_STALL_TIMEOUT,
+    fan_out,
+    relay,
+    set_pipe_size,
+    throttle,
 )
-from btr_backup.log import logger
-from btr_backup.protocols import Subparsers
+from btr_backup.transport import (
+    COMPRESSORS,
+    CommandTransport,
+    LocalTransport,
+    Target,
+    Transport,
+)
+
+DEFAULT_THROUGHPUT = 100 * 1024 * 1024
+IO_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+
+
+def ionice_command(io_class: str | None, io_level: int | None) -> list[str]:
+    if io_class is None and io_level is None:
+        return []
+
+    io_class = io_class or "best-effort"
+    command = ["ionice", "-c", str(IO_CLASSES[io_class])]
+    # The idle class has no levels, ionice warns when given one.
+    if io_level is not None and io_class != "idle":
+        command.extend(["-n", str(io_level)])
+
+    return command
+
+
+def archived_uuids(dir: Path) -> set[bytes]:
+    return {
+        bytes.fromhex(manifest["uuid"]) for manifest in load_manifests(dir).values()
+    }
+
+
+def common_snapshot(
+    source: Path,
+    source_snapshots: list[str],
+    received: set[bytes],
+) -> str | None:
+    return next(
+        (name for name in source_snapshots if send_uuid(source / name) in received),
+        None,
+    )
+
+
+def upload_chain(
+    source_snapshots: list[str],
+    common: str | None,
+    *,
+    catch_up: bool,
+) -> list[tuple[str, str | None]]:
+    missing = list(takewhile(lambda name: name != common, source_snapshots))
+    if not catch_up:
+        missing = missing[:1]
+
+    chain = missing[::-1]
+    return list(zip(chain, [common, *chain[:-1]]))
+
+
+def upload_steps(
+    source: Path,
+    received: list[set[bytes]],
+    *,
+    catch_up: bool,
+) -> list[tuple[str, str | None]]:
+    """Distinct snapshot and parent pairs any of the destinations is missing.
+
+    Destinations sharing a pair are fed from a single send, so the pairs are
+    what an upload to all of them sends, ordered oldest snapshot first.
+    """
+    source_snapshots = snapshots_for(source)
+    steps = {
+        step: None
+        for uuids in received
+        for step in upload_chain(
+            source_snapshots,
+            common_snapshot(source, source_snapshots, uuids),
+            catch_up=catch_up,
+        )
+    }
+
+    # The catalog lists snapshots newest first.
+    position = {name: index for index, name in enumerate(source_snapshots)}
+    return sorted(steps, key=lambda step: -position[step[0]])
+
+
+def estimate_upload(
+    source: Path,
+    received: list[set[bytes]],
+    *,
+    catch_up: bool,
+) -> tuple[int, int]:
+    """Number of snapshots an upload sends and the estimated bytes it moves."""
+    chain = upload_steps(source, received, catch_up=catch_up)
+
+    with metrics.measure("estimate", source.name):
+        size = sum(
+            estimate_send_size(source / name, source / parent if parent else None)
+            for name, parent in chain
+        )
+
+    return len(chain), size
+
+
+def plan_uploads(
+    directories: list[Path],
+    received: Callable[[Path], list[set[bytes]]],
+    *,
+    catch_up: bool,
+    jobs: int,
+    window: float | None,
+    throughput: int,
+) -> list[Path]:
+    """Order directories largest estimated upload first and log the plan.
+
+    Starting the largest transfers first keeps a single big directory from
+    running alone at the end of the window.
+    """
+    estimates: dict[Path, int] = {}
+
+    for directory in directories:
+        try:
+            count, size = estimate_upload(
+                directory, received(directory), catch_up=catch_up
+            )
+        except (OSError, ValueError) as e:
+            logger.warning("Estimating upload of %s failed: %s", directory.name, e)
+            continue
+
+        estimates[directory] = size
+        logger.info(
+            "Plan: %s, %d snapshots, about %s",
+            directory.name,
+            count,
+            format_size(size),
+        )
+
+    duration = makespan(list(estimates.values()), jobs) / throughput
+    logger.info("Estimated upload time %.0f seconds with %d jobs.", duration, jobs)
+
+    if window is not None and duration > window:
+        logger.warning(
+            "Estimated upload time %.0f seconds exceeds the %.0f second window.",
+            duration,
+            window,
+        )
+
+    # Directories that could not be estimated go last, in their listed order.
+    return sorted(directories, key=lambda directory: -estimates.get(directory, -1))
+
+
+def stream_snapshot(
+    snapshot: Path,
+    parent: Path | None,
+    destinations: list[tuple[Transport, Path]],
+    *,
+    buffer_size: int,
+    stall_timeout: float,
+    checksum: bool,
+) -> list[bool]:
+    """Send a snapshot once and receive it into every destination.
+
+    Returns whether each destination received the snapshot, a destination
+    failing or falling behind the others is dropped without affecting them.
+    With checksum the send stream is hashed on its way and recorded.
+    """
+    digest = sha256() if checksum else None
+
+    with ExitStack() as stack:
+        measurement = stack.enter_context(
+            metrics.measure("stream", snapshot.parent.name)
+        )
+        send = stack.enter_context(backend.send(snapshot, parent))
+        receives = [
+            stack.enter_context(transport.receive(destination))
+            for transport, destination in destinations
+        ]
+        assert send.stdout is not None
+        assert all(receive.stdin is not None for receive in receives)
+
+        source = send.stdout.fileno()
+        sinks = [receive.stdin.fileno() for receive in receives if receive.stdin]
+
+        set_pipe_size(source, buffer_size)
+        for sink in sinks:
+            set_pipe_size(sink, buffer_size)
+
+        def drop(index: int) -> None:
+            logger.warning(
+                "Receiving snapshot into %s fell behind, dropping it.",
+                destinations[index][1],
+            )
+            destinations[index][0].abort(receives[index])
+
+        if len(sinks) == 1:
+            # A single destination keeps the zero-copy relay.
+            try:
+                measurement.bytes = relay(source, sinks[0], buffer_size, digest)
+                delivered = [True]
+            except BrokenPipeError:
+                delivered = [False]
+        else:
+            measurement.bytes, delivered = fan_out(
+                source,
+                sinks,
+                buffer_size,
+                drop=drop,
+                stall_timeout=stall_timeout,
+                digest=digest,
+            )
+
+        if not any(delivered):
+            send.kill()
+
+        sent = send.wait() == 0
+        if any(delivered) and not sent:
+            logger.error("Failed to send snapshot %s.", snapshot)
+
+        results = []
+        for receive, (transport, destination), ok in zip(
+            receives, destinations, delivered
+        ):
+            if sent and receive.stdin:
+                receive.stdin.close()
+            else:
+                transport.abort(receive)
+
+            received = receive.wait() == 0
+            if not ok or (sent and not received):
+                logger.error("Receiving snapshot into %s failed.", destination)
 
+            results.append(ok and sent and received)
 
-def btrfs_progs_available() -> bool:
-    command = ["btrfs", "--help"]
-    return run(command, stdout=DEVNULL, stderr=DEVNULL).returncode == 0
+    logger.debug("Streamed %d bytes of snapshot %s.", measurement.bytes, snapshot)
 
+    if digest and any(results):
+        record = StreamRecord(
+            parent=parent.name if parent else None,
+            size=measurement.bytes,
+            sha256=digest.hexdigest(),
+        )
+        directory = snapshot.parent
+        record_stream(directory.parent, directory.name, snapshot.name, record)
+
+    return results
+
+
+def checkpoint_snapshot(
+    snapshot: Path,
+    parent: Path | None,
+    destination: Path,
+    staging: Path,
+    *,
+    transport: Transport,
+    buffer_size: int,
+    checkpoint_size: int,
+) -> bool:
+    progress = load_progress(staging, parent.name if parent else None, checkpoint_size)
+
+    if progress["complete"]:
+        logger.info("Send stream of %s is already checkpointed.", snapshot)
+    else:
+        if progress["chunks"]:
+            logger.info(
+                "Resuming send of %s after %d checkpointed chunks.",
+                snapshot,
+                len(progress["chunks"]),
+            )
 
-def btrfs_send(subvol: Path, parent: Path | None, stdout: IO[bytes]) -> bool:
-    command = ["btrfs", "send", str(subvol)]
-    if parent:
-        command.extend(["-p", str(parent)])
+        with (
+            metrics.measure("send", snapshot.parent.name) as measurement,
+            backend.send(snapshot, parent) as send,
+        ):
+            assert send.stdout is not None
+            count, measurement.bytes = checkpoint_stream(
+                send.stdout.fileno(), staging, progress
+            )
 
-    return run(command, stdout=stdout, stderr=DEVNULL).returncode == 0
+        if send.returncode != 0:
+            logger.error("Failed to send snapshot %s.", snapshot)
+            return False
 
+        complete_checkpoint(staging, progress, count)
 
-def btrfs_receive(path: Path, stdin: IO[bytes]) -> bool:
-    command = ["btrfs", "receive", str(path)]
-    return run(command, stdin=stdin, stdout=DEVNULL, stderr=DEVNULL).returncode == 0
+    with (
+        metrics.measure("receive", snapshot.parent.name) as measurement,
+        transport.receive(destination) as receive,
+    ):
+        assert receive.stdin is not None
 
+        set_pipe_size(receive.stdin.fileno(), buffer_size)
 
-def last_snapshot(dir: Path) -> Path | None:
-    subvols = snapshots_for(dir)
-    return dir / subvols[0] if subvols else None
+        try:
+            for chunk in checkpointed_chunks(staging, progress):
+                with chunk.open("rb") as file:
+                    measurement.bytes += relay(
+                        file.fileno(), receive.stdin.fileno(), buffer_size
+                    )
+        except BrokenPipeError:
+            receive.wait()
+            logger.error("Receiving snapshot into %s failed.", destination)
+            return False
+
+        receive.stdin.close()
+
+        if receive.wait() != 0:
+            logger.error("Receiving snapshot into %s failed.", destination)
+            return False
 
+    rmtree(staging)
 
-def upload_snapshot(source: Path, destination: Path) -> bool:
+    return True
+
+
+def upload_snapshot(
+    source: Path,
+    targets: list[Target],
+    *,
+    buffer_size: int,
+    stall_timeout: float,
+    checksum: bool,
+    catch_up: bool,
+    resumable: bool,
+    checkpoint_size: int,
+) -> bool:
     logger.debug("Processing subvolume directory: %s", source)
 
-    snapshot = last_snapshot(source)
-    if not snapshot:
+    source_snapshots = snapshots_for(source)
+    if not source_snapshots:
         logger.warning("No snapshots found in %s, skipping.", source)
         return True
 
-    destination.mkdir(exist_ok=True)
+    chains: dict[Target, list[tuple[str, str | None]]] = {}
+    for target in targets:
+        destination = target.workdir / source.name
+        target.transport.prepare(destination)
+
+        received = target.transport.received_uuids(destination)
+        common = common_snapshot(source, source_snapshots, received)
+        logger.debug("Newest snapshot shared with %s: %s", target.id, common)
 
-    destination_snapshot = last_snapshot(destination)
-    if destination_snapshot and destination_snapshot.name == snapshot.name:
+        if common:
+            record_upload(source.parent, target.id, source.name, common)
+
+        chains[target] = upload_chain(source_snapshots, common, catch_up=catch_up)
+
+        if resumable:
+            # Checkpoints outside the chain belong to uploads that will not resume.
+            prune_staging(
+                staging_directory(target.workdir, source.name),
+                {name for name, _ in chains[target]},
+            )
+
+    if not any(chains.values()):
         logger.warning(
             "Snapshot %s already exists in destination, skipping.",
-            snapshot.name,
+            source_snapshots[0],
         )
         return True
 
-    parent = None
-    if destination_snapshot:
-        parent = snapshot.with_name(destination_snapshot.name)
-
-    with TemporaryFile(prefix="btr-backup-") as buffer:
-        logger.info(
-            "Uploading snapshot %s, parent snapshot %s",
-            snapshot.relative_to(source.parent),
-            parent.relative_to(source.parent) if parent else "None",
-        )
-        if not btrfs_send(snapshot, parent, buffer):
-            logger.error(
-                "Failed to send snapshot %s to temporary file.",
-                snapshot.stem,
+    position = {name: index for index, name in enumerate(source_snapshots)}
+    steps = sorted(
+        {step for chain in chains.values() for step in chain},
+        key=lambda step: -position[step[0]],
+    )
+    failed: set[Target] = set()
+
+    for name, parent_name in steps:
+        with log_fields(snapshot=name):
+            receivers = [
+                target
+                for target, chain in chains.items()
+                if (name, parent_name) in chain and target not in failed
+            ]
+            if not receivers:
+                continue
+
+            snapshot = source / name
+            parent = source / parent_name if parent_name else None
+
+            logger.info(
+                "Uploading snapshot %s, parent snapshot %s",
+                snapshot.relative_to(source.parent),
+                parent.relative_to(source.parent) if parent else "None",
             )
+            if resumable:
+                destination = receivers[0].workdir / source.name
+                uploaded = [
+                    checkpoint_snapshot(
+                        snapshot,
+                        parent,
+                        destination,
+                        staging_directory(receivers[0].workdir, source.name) / name,
+                        transport=receivers[0].transport,
+                        buffer_size=buffer_size,
+                        checkpoint_size=checkpoint_size,
+                    )
+                ]
+            else:
+                uploaded = stream_snapshot(
+                    snapshot,
+                    parent,
+                    [
+                        (target.transport, target.workdir / source.name)
+                        for target in receivers
+                    ],
+                    buffer_size=buffer_size,
+                    stall_timeout=stall_timeout,
+                    checksum=checksum,
+                )
+
+            for target, ok in zip(receivers, uploaded):
+                subvol = target.workdir / source.name / name
+                if not ok:
+                    target.transport.discard(subvol)
+                    failed.add(target)
+                    continue
+
+                target.transport.received(subvol)
+                record_upload(source.parent, target.id, source.name, name)
+
+    if failed and len(targets) > 1:
+        logger.error(
+            "Uploading %s to %s failed.",
+            source.name,
+            ", ".join(target.id for target in targets if target in failed),
+        )
+
+    return not failed
+
+
+def archive_snapshot(
+    snapshot: Path,
+    parent: Path | None,
+    destination: Path,
+    store: Path,
+) -> bool:
+    with (
+        metrics.measure("archive", snapshot.parent.name) as measurement,
+        backend.send(snapshot, parent) as send,
+    ):
+        assert send.stdout is not None
+
+        try:
+            chunks, size, stored = archive_stream(send.stdout.fileno(), store)
+            measurement.bytes = size
+        except ValueError as e:
+            send.kill()
+            logger.error("Failed to archive snapshot %s: %s", snapshot, e)
             return False
 
-        buffer.seek(0)
+    if send.returncode != 0:
+        logger.error("Failed to send snapshot %s.", snapshot)
+        return False
+
+    manifest = Manifest(
+        uuid=send_uuid(snapshot).hex(),
+        parent_uuid=send_uuid(parent).hex() if parent else None,
+        size=size,
+        compression=COMPRESSION,
+        chunks=chunks,
+    )
+    write_manifest(destination, snapshot.name, manifest)
+
+    logger.debug(
+        "Archived %d bytes of snapshot %s, stored %d new bytes.",
+        size,
+        snapshot,
+        stored,
+    )
+
+    return True
+
+
+def archive_snapshots(
+    source: Path,
+    *,
+    archive: Path,
+    catch_up: bool,
+) -> bool:
+    logger.debug("Processing subvolume directory: %s", source)
+
+    destination = archive / source.name
+    store = chunk_store(archive)
+    destination_id = str(archive.absolute())
+
+    source_snapshots = snapshots_for(source)
+    if not source_snapshots:
+        logger.warning("No snapshots found in %s, skipping.", source)
+        return True
+
+    destination.mkdir(exist_ok=True)
+
+    common = common_snapshot(source, source_snapshots, archived_uuids(destination))
+    logger.debug("Newest snapshot shared with archive: %s", common)
+
+    if common:
+        record_upload(source.parent, destination_id, source.name, common)
+
+    chain = upload_chain(source_snapshots, common, catch_up=catch_up)
+    if not chain:
+        logger.warning(
+            "Snapshot %s already exists in archive, skipping.",
+            source_snapshots[0],
+        )
+        return True
+
+    for name, parent_name in chain:
+        with log_fields(snapshot=name):
+            snapshot = source / name
+            parent = source / parent_name if parent_name else None
 
-        if not btrfs_receive(destination, buffer):
-            logger.error(
-                "Failed to receive snapshot from temporary file to %s.",
-                destination,
+            logger.info(
+                "Archiving snapshot %s, parent snapshot %s",
+                snapshot.relative_to(source.parent),
+                parent.relative_to(source.parent) if parent else "None",
             )
-            return False
+            if not archive_snapshot(snapshot, parent, destination, store):
+                return False
+
+            record_upload(source.parent, destination_id, source.name, name)
 
     return True
 
 
+def report_uploads(uploads: dict[str, Future[bool]]) -> bool:
+    succeeded, failed = [], []
+
+    for name, upload in uploads.items():
+        try:
+            uploaded = upload.result()
+        except OSError as e:
+            logger.error("Uploading %s failed: %s", name, e)
+            uploaded = False
+        except Exception:
+            # A bug in one directory must not hide the outcome of the others.
+            logger.exception("Uploading %s failed.", name)
+            uploaded = False
+
+        (succeeded if uploaded else failed).append(name)
+
+    if succeeded:
+        logger.info("Uploaded: %s", ", ".join(succeeded))
+
+    if failed:
+        logger.error("Failed to upload: %s", ", ".join(failed))
+
+    return not failed
+
+
+def mount_destination(
+    stack: ExitStack,
+    dest_dev: Path,
+    dest_chdir: Path,
+) -> Path | None:
+    temp_dir = stack.enter_context(TemporaryDirectory(prefix="btr-backup-"))
+
+    try:
+        with metrics.measure("mount_destination"):
+            mount_point = stack.enter_context(
+                mount_context(dest_dev, temp_dir, "btrfs")
+            )
+    except OSError as e:
+        logger.error(
+            "Failed to mount %s device to %s: %s",
+            dest_dev,
+            temp_dir,
+            e.strerror,
+        )
+        return None
+
+    dest_workdir = mount_point / dest_chdir
+    if not dest_workdir.exists():
+        logger.error(
+            "Destination working directory %s does not exist.",
+            dest_workdir,
+        )
+        return None
+
+    stack.callback(catalog_for(dest_workdir).save)
+
+    return dest_workdir
+
+
+def mount_destinations(
+    stack: ExitStack,
+    dest_devs: list[Path],
+    dest_chdir: Path,
+) -> list[Path] | None:
+    dest_workdirs = []
+
+    for dest_dev in dest_devs:
+        dest_workdir = mount_destination(stack, dest_dev, dest_chdir)
+        if dest_workdir is None:
+            return None
+        dest_workdirs.append(dest_workdir)
+
+    return dest_workdirs
+
+
+def open_targets(
+    stack: ExitStack,
+    *,
+    dest_dev: list[Path] | None,
+    dest_command: list[list[str]] | None,
+    dest_chdir: Path,
+    compress: str | None,
+    dest_workdirs: list[Path] | None = None,
+) -> list[Target] | None:
+    """Targets of the destination options, mounting devices unless given."""
+    if dest_command:
+        if not dest_chdir.is_absolute():
+            logger.error("--dest-chdir must be absolute with --dest-command.")
+            return None
+
+        targets = []
+        for command in dest_command:
+            transport = CommandTransport(
+                command, PurePosixPath(dest_chdir), compress=compress
+            )
+            stack.callback(transport.close)
+            target_id = f"{shlex.join(command)}:{dest_chdir}"
+            targets.append(Target(transport, dest_chdir, target_id))
+        return targets
+
+    assert dest_dev is not None
+    if dest_workdirs is None:
+        dest_workdirs = mount_destinations(stack, dest_dev, dest_chdir)
+        if dest_workdirs is None:
+            return None
+
+    return [
+        Target(LocalTransport(), dest_workdir, f"{device}:{dest_chdir}")
+        for device, dest_workdir in zip(dest_dev, dest_workdirs)
+    ]
+
+
 def upload_snapshots(
     workdir: Path,
     *,
     include: list[str],
     exclude: list[str],
-    dest_dev: Path,
+    dest_dev: list[Path] | None,
+    dest_command: list[list[str]] | None,
     dest_chdir: Path,
+    archive_dir: Path | None,
+    compress: str | None,
+    buffer_size: int,
+    stall_timeout: float,
+    checksum: bool,
+    verify: bool,
+    jobs: int,
+    catch_up: bool,
+    resumable: bool,
+    checkpoint_size: int,
+    estimate: bool | None,
+    window: float | None,
+    throughput: int,
+    bwlimit: int | None,
+    bwlimit_file: Path | None,
+    ionice_class: str | None,
+    ionice_level: int | None,
+    dest_workdirs: list[Path] | None = None,
     **kwargs: Any,
 ) -> bool:
-    if not btrfs_progs_available():
+    """Upload snapshots, mounting the destinations unless dest_workdirs are given.
+
+    With several destinations every snapshot is sent once and received into
+    all of them at the same time.
+    """
+    if not backend.progs_available():
         logger.error("btrfs-progs not available.")
         return False
 
-    with ExitStack() as stack:
-        temp_dir = stack.enter_context(TemporaryDirectory(prefix="btr-backup-"))
-
-        try:
-            mount_point = stack.enter_context(
-                mount_context(dest_dev, temp_dir, "btrfs")
-            )
-        except OSError as e:
-            logger.error(
-                "Failed to mount %s device to %s: %s", dest_dev, temp_dir, e.strerror
-            )
-            return False
-
-        dest_workdir = mount_point / dest_chdir
-        if not dest_workdir.exists():
-            logger.error(
-                "Destination working directory %s does not exist.",
-                dest_workdir,
-            )
-            return False
+    throttle.configure(bwlimit, bwlimit_file)
+    backend.priority = ionice_command(ionice_class, ionice_level)
 
+    with metrics.measure("enumerate"):
         directories = include_exclude(
-            workdir.iterdir(),
+            logical_directories(workdir),
             include,
             exclude,
             attrgetter("name"),
         )
 
-        return all(
-            upload_snapshot(directory, dest_workdir / directory.name)
-            for directory in directories
-        )
+    with ExitStack() as stack:
+        targets: list[Target] = []
+
+        if archive_dir:
+            if not archive_dir.is_dir():
+                logger.error("Archive directory %s does not exist.", archive_dir)
+                return False
+
+            if verify:
+                logger.error("Verifying uploads needs a btrfs destination.")
+                return False
+
+            upload = partial(archive_snapshots, archive=archive_dir, catch_up=catch_up)
+        else:
+            if resumable and dest_command:
+                logger.error("Resumable uploads need a mounted destination.")
+                return False
+
+            if resumable and dest_dev and len(dest_dev) > 1:
+                logger.error("Resumable uploads need a single destination.")
+                return False
+
+            opened = open_targets(
+                stack,
+                dest_dev=dest_dev,
+                dest_command=dest_command,
+                dest_chdir=dest_chdir,
+                compress=compress,
+                dest_workdirs=dest_workdirs,
+            )
+            if opened is None:
+                return False
+            targets = opened
+
+            upload = partial(
+                upload_snapshot,
+                targets=targets,
+                buffer_size=buffer_size,
+                stall_timeout=stall_timeout,
+                checksum=checksum,
+                catch_up=catch_up,
+                resumable=resumable,
+                checkpoint_size=checkpoint_size,
+            )
 
+        # Ordering matters to concurrent uploads only, and a window needs the
+        # estimate, each of which otherwise costs a send per pending snapshot.
+        if estimate is None:
+            estimate = jobs > 1 or window is not None
+
+        if estimate:
+
+            def received(directory: Path) -> list[set[bytes]]:
+                if archive_dir:
+                    return [archived_uuids(archive_dir / directory.name)]
+                return [
+                    target.transport.received_uuids(target.workdir / directory.name)
+                    for target in targets
+                ]
+
+            directories = plan_uploads(
+                directories,
+                received,
+                catch_up=catch_up,
+                jobs=jobs,
+                window=window,
+                throughput=throughput,
+            )
 
-def add_command(subparsers: Subparsers) -> None:
-    parser = subparsers.add_parser(
-        "upload",
-        help="Copy snapshots from one btrfs filesystem to another.",
-    )
+        def upload_directory(directory: Path) -> bool:
+            with (
+                log_fields(directory=directory.name),
+                locks.hold(directory, exclusive=True) as held,
+            ):
+                return upload(directory) if held else True
+
+        # The executor starts uploads in submission order, largest first.
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                directory.name: executor.submit(upload_directory, directory)
+                for directory in directories
+            }
+
+        uploaded = report_uploads(futures)
+
+        if verify and targets:
+            # Listings cached before the uploads miss the new snapshots.
+            for target in targets:
+                target.transport.reload()
+
+            verified = verify_directories(
+                directories, targets, jobs=jobs, content=False
+            )
+            uploaded = verified and uploaded
 
-    parser.add_argument(
+        return uploaded
+
+
+def add_upload_arguments(parser: ArgumentParser, *, required: bool = True) -> None:
+    destination = parser.add_mutually_exclusive_group(required=required)
+
+    destination.add_argument(
         "--dest-dev",
         type=block_device,
-        required=True,
-        help="Destination block device to copy snapshots to.",
+        action="append",
+        help="Destination block device to copy snapshots to, repeat it to "
+        "copy every snapshot to several devices from a single send.",
+    )
+    destination.add_argument(
+        "--archive-dir",
+        type=Path,
+        help="Directory on any filesystem to store compressed send streams in.",
+    )
+    destination.add_argument(
+        "--dest-command",
+        type=shlex.split,
+        action="append",
+        help="Command prefix running btrfs on the destination, like 'ssh host', "
+        "with --dest-chdir the absolute destination directory there. Repeat it "
+        "to copy every snapshot to several hosts from a single send.",
     )
     parser.add_argument(
         "--dest-chdir",
@@ -150,6 +863,105 @@ def add_command(subparsers: Subparsers) -> None:
         default=Path(),
         help="Directory on destination block device with directory structure.",
     )
+    parser.add_argument(
+        "--compress",
+        choices=list(COMPRESSORS),
+        help="Compress send streams on the way to --dest-command.",
+    )
+    parser.add_argument(
+        "--buffer-size",
+        type=int,
+        default=DEFAULT_BUFFER_SIZE,
+        help="Size in bytes of the pipe buffer between btrfs send and receive.",
+    )
+    parser.add_argument(
+        "--stall-timeout",
+        type=float,
+        default=DEFAULT_STALL_TIMEOUT,
+        help="Seconds a destination may hold back the others before it is "
+        "dropped from the upload.",
+    )
+    parser.add_argument(
+        "--catch-up",
+        action=BooleanOptionalAction,
+        default=False,
+        help="Upload every snapshot missing from destination, not only the latest.",
+    )
+    parser.add_argument(
+        "--resumable",
+        action=BooleanOptionalAction,
+        default=False,
+        help="Checkpoint send streams on destination so interrupted uploads resume.",
+    )
+    parser.add_argument(
+        "--checkpoint-size",
+        type=int,
+        default=DEFAULT_CHECKPOINT_SIZE,
+        help="Size in bytes of the checkpointed chunks of a resumable upload.",
+    )
+    parser.add_argument(
+        "--checksum",
+        action=BooleanOptionalAction,
+        default=False,
+        help="Record a checksum of every send stream while uploading it, for "
+        "verify --content. Streams then pass through user space.",
+    )
+    parser.add_argument(
+        "--verify",
+        action=BooleanOptionalAction,
+        default=False,
+        help="Verify the btrfs destinations by metadata after uploading.",
+    )
+    parser.add_argument(
+        "--estimate",
+        action=BooleanOptionalAction,
+        help="Estimate upload sizes with metadata-only sends and upload the "
+        "largest directories first, by default with several jobs or a window.",
+    )
+    parser.add_argument(
+        "--window",
+        type=float,
+        help="Seconds uploads may take, warn when the estimate exceeds them.",
+    )
+    parser.add_argument(
+        "--throughput",
+        type=int,
+        default=DEFAULT_THROUGHPUT,
+        help="Expected bytes per second of an upload, to turn estimates into time.",
+    )
+    parser.add_argument(
+        "--bwlimit",
+        type=byte_size,
+        help="Bytes per second all uploads together may move, like 20M.",
+    )
+    parser.add_argument(
+        "--bwlimit-file",
+        type=Path,
+        help="File holding a bandwidth limit that replaces --bwlimit whenever "
+        "it changes, so the limit can be adjusted during an upload.",
+    )
+    parser.add_argument(
+        "--ionice-class",
+        choices=list(IO_CLASSES),
+        help="I/O scheduling class of btrfs send and receive.",
+    )
+    parser.add_argument(
+        "--ionice-level",
+        type=int,
+        choices=range(8),
+        help="I/O priority within the scheduling class, 0 is the highest.",
+    )
+
+
+def add_arguments(parser: ArgumentParser) -> None:
+    add_upload_arguments(parser)
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of logical directories to upload concurrently.",
+    )
     group = parser.add_mutually_exclusive_group()
 
     group.add_argument(
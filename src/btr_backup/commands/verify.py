@@ -0,0 +1,108 @@
+import shlex
+from argparse import ArgumentParser, BooleanOptionalAction
+from contextlib import ExitStack
+from operator import attrgetter
+from pathlib import Path
+from typing import Any
+
+from btr_backup.backend import backend
+from btr_backup.commands.upload import open_targets
+from btr_backup.common import block_device, include_exclude, logical_directories
+from btr_backup.integrity import verify_directories
+from btr_backup.log import logger
+from btr_backup.metrics import metrics
+
+
+def verify_snapshots(
+    workdir: Path,
+    *,
+    include: list[str],
+    exclude: list[str],
+    dest_dev: list[Path] | None,
+    dest_command: list[list[str]] | None,
+    dest_chdir: Path,
+    jobs: int,
+    content: bool,
+    **kwargs: Any,
+) -> bool:
+    if not backend.progs_available():
+        logger.error("btrfs-progs not available.")
+        return False
+
+    with metrics.measure("enumerate"):
+        directories = include_exclude(
+            logical_directories(workdir),
+            include,
+            exclude,
+            attrgetter("name"),
+        )
+
+    with ExitStack() as stack:
+        targets = open_targets(
+            stack,
+            dest_dev=dest_dev,
+            dest_command=dest_command,
+            dest_chdir=dest_chdir,
+            compress=None,
+        )
+        if targets is None:
+            return False
+
+        return verify_directories(directories, targets, jobs=jobs, content=content)
+
+
+def add_arguments(parser: ArgumentParser) -> None:
+    destination = parser.add_mutually_exclusive_group(required=True)
+
+    destination.add_argument(
+        "--dest-dev",
+        type=block_device,
+        action="append",
+        help="Destination block device to verify, can be repeated.",
+    )
+    destination.add_argument(
+        "--dest-command",
+        type=shlex.split,
+        action="append",
+        help="Command prefix running btrfs on the destination, like 'ssh host', "
+        "can be repeated.",
+    )
+    parser.add_argument(
+        "--dest-chdir",
+        type=Path,
+        default=Path(),
+        help="Directory on destination block device with directory structure.",
+    )
+    parser.add_argument(
+        "--content",
+        action=BooleanOptionalAction,
+        default=False,
+        help="Also send source snapshots again and compare them with the "
+        "checksums recorded by upload --checksum. Only the source is read, data "
+        "damaged on the destination is not detected.",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of logical directories to verify concurrently.",
+    )
+    group = parser.add_mutually_exclusive_group()
+
+    group.add_argument(
+        "--include",
+        "-i",
+        type=str,
+        action="append",
+        help="Include only specified subvolumes.",
+    )
+    group.add_argument(
+        "--exclude",
+        "-e",
+        type=str,
+        action="append",
+        help="Include only subvolumes that were not specified.",
+    )
+
+    parser.set_defaults(func=verify_snapshots)
@@ -1,10 +1,13 @@
+import re
 from argparse import ArgumentTypeError
-from collections.abc import Callable, Iterable, Iterator
-from contextlib import contextmanager, suppress
-from os import PathLike, fspath
+from collections.abc import Callable, Iterable
+from os import fchmod, fsync
 from pathlib import Path
+from tempfile import NamedTemporaryFile
 
-from mount import mount, umount
+STATE_DIR = ".btr-backup"
+SIZE_UNITS = ["B", "KiB", "MiB", "GiB", "TiB", "PiB"]
+BYTE_SIZE = re.compile(r"(\d+(?:\.\d+)?)\s*([KMGTP]?)(?:i?B)?", re.IGNORECASE)
 
 
 def block_device(arg: str) -> Path:
@@ -19,14 +22,15 @@ def block_device(arg: str) -> Path:
     return path
 
 
-@contextmanager
-def mount_context(device: PathLike, destination: PathLike, fs: str) -> Iterator[Path]:
-    mount(fspath(device), fspath(destination), fs)
-    try:
-        yield Path(destination)
-    finally:
-        with suppress(OSError):
-            umount(fspath(destination))
+def byte_size(arg: str) -> int:
+    """Parse a number of bytes with an optional binary suffix like 10M or 1.5GiB."""
+    match = BYTE_SIZE.fullmatch(arg.strip())
+    if match is None:
+        raise ArgumentTypeError(f"{arg} is not a size in bytes.")
+
+    value, unit = match.groups()
+    exponent = "BKMGTP".index(unit.upper() or "B")
+    return int(float(value) * 1024**exponent)
 
 
 def include_exclude[T, U](
@@ -47,8 +51,42 @@ def include_exclude[T, U](
     return list(values)
 
 
-def snapshots_for(dir: Path) -> list[str]:
-    return sorted(
-        [snapshot.name for snapshot in dir.iterdir() if snapshot.name != "active"],
-        reverse=True,
-    )
+listings: dict[Path, tuple[int, list[Path]]] = {}
+
+
+def logical_directories(workdir: Path) -> list[Path]:
+    """Logical directories of a workdir, listed again only once it changed.
+
+    Commands running in the same process, like the stages of run, share the
+    listing instead of enumerating the workdir each.
+    """
+    mtime = workdir.stat().st_mtime_ns
+    listing = listings.get(workdir)
+
+    if listing is None or listing[0] != mtime:
+        directories = [path for path in workdir.iterdir() if path.name != STATE_DIR]
+        listing = listings[workdir] = (mtime, directories)
+
+    return listing[1]
+
+
+def format_size(size: int) -> str:
+    value = float(size)
+    for unit in SIZE_UNITS[:-1]:
+        if value < 1024:
+            break
+        value /= 1024
+    else:
+        unit = SIZE_UNITS[-1]
+
+    return f"{size} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+
+
+def write_atomic(path: Path, data: bytes, mode: int = 0o644) -> None:
+    with NamedTemporaryFile(dir=path.parent, prefix=".", delete=False) as file:
+        # Temporary files are private, the file replaced is read by others.
+        fchmod(file.fileno(), mode)
+        file.write(data)
+        file.flush()
+        fsync(file.fileno())
+    Path(file.name).replace(path)
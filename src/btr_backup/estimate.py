@@ -0,0 +1,68 @@
+from heapq import heapify, heapreplace
+from pathlib import Path
+from struct import Struct
+from typing import BinaryIO
+
+from btr_backup.archive import (
+    ATTRIBUTE_SIZE,
+    COMMAND_HEADER,
+    UPDATE_EXTENT,
+    send_stream_commands,
+)
+from btr_backup.backend import backend
+
+ATTRIBUTE_HEADER = Struct("<HH")
+
+
+def attribute_size(payload: bytes) -> int:
+    offset = 0
+    while offset + ATTRIBUTE_HEADER.size <= len(payload):
+        kind, length = ATTRIBUTE_HEADER.unpack_from(payload, offset)
+        offset += ATTRIBUTE_HEADER.size
+        if kind == ATTRIBUTE_SIZE:
+            return int.from_bytes(payload[offset : offset + length], "little")
+        offset += length
+    return 0
+
+
+def full_stream_size(stream: BinaryIO) -> int:
+    """Size of a send stream with the data left out by --no-data added back.
+
+    A send with --no-data replaces every write with an update extent command
+    carrying only the length of the data, so the metadata stream plus those
+    lengths approximates the full stream.
+    """
+    commands = send_stream_commands(stream)
+    header, _ = next(commands)
+    size = len(header)
+
+    for command, _ in commands:
+        size += len(command)
+        _, kind, _ = COMMAND_HEADER.unpack_from(command)
+        if kind == UPDATE_EXTENT:
+            size += attribute_size(command[COMMAND_HEADER.size :])
+
+    return size
+
+
+def estimate_send_size(snapshot: Path, parent: Path | None) -> int:
+    """Estimate the size of a send stream without reading file contents."""
+    with backend.send(snapshot, parent, no_data=True) as send:
+        assert send.stdout is not None
+        size = full_stream_size(send.stdout)
+
+    if send.returncode != 0:
+        raise OSError(f"Failed to send metadata of snapshot {snapshot}.")
+
+    return size
+
+
+def makespan(sizes: list[int], jobs: int) -> int:
+    """Largest load of jobs workers that always take the largest size left."""
+    loads = [0] * max(min(jobs, len(sizes)), 1)
+    heapify(loads)
+
+    for size in sorted(sizes, reverse=True):
+        heapreplace(loads, loads[0] + size)
+
+    return max(loads)
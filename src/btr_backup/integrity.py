@@ -0,0 +1,163 @@
+"""Checks that snapshots on a destination are complete copies of their sources.
+
+Received snapshots are checked by metadata only, the received UUID and the
+read-only flag that btrfs receive sets once a stream was applied whole. The
+optional content check sends the source snapshot again and compares it with
+the checksum recorded while it was uploaded. It never reads the destination,
+so it finds sources that no longer produce the uploaded stream but not data
+damaged on the destination, which a scrub of the destination filesystem does.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from os import read
+from pathlib import Path
+
+from btr_backup.backend import backend
+from btr_backup.btrfs import send_uuid
+from btr_backup.catalog import snapshots_for
+from btr_backup.lock import locks
+from btr_backup.log import logger
+from btr_backup.metrics import metrics
+from btr_backup.state import load_stream, load_upload_state
+from btr_backup.stream import DEFAULT_BUFFER_SIZE
+from btr_backup.transport import Target
+
+
+def stream_checksum(snapshot: Path, parent: Path | None) -> tuple[int, str]:
+    digest = sha256()
+    size = 0
+
+    with backend.send(snapshot, parent) as send:
+        assert send.stdout is not None
+        while chunk := read(send.stdout.fileno(), DEFAULT_BUFFER_SIZE):
+            digest.update(chunk)
+            size += len(chunk)
+
+    if send.returncode != 0:
+        raise OSError(f"Failed to send snapshot {snapshot}.")
+
+    return size, digest.hexdigest()
+
+
+def check_content(source: Path, name: str) -> str | None:
+    """Compare the send stream of a source snapshot with the uploaded one."""
+    record = load_stream(source.parent, source.name, name)
+    if record is None:
+        return None
+
+    parent = source / record["parent"] if record["parent"] else None
+    if parent and not parent.exists():
+        logger.debug("Parent of %s is gone, skipping content check.", name)
+        return None
+
+    with metrics.measure("verify_content", source.name) as measurement:
+        size, checksum = stream_checksum(source / name, parent)
+        measurement.bytes = size
+
+    if (size, checksum) != (record["size"], record["sha256"]):
+        return f"Send stream of {source / name} differs from the uploaded one."
+    return None
+
+
+def verify_target(source: Path, target: Target) -> tuple[list[str], set[str]]:
+    """Problems of a directory on a target and the snapshots received there."""
+    destination = target.workdir / source.name
+    logger.info("Verifying %s on %s", source.name, target.id)
+
+    with metrics.measure("verify", source.name):
+        received = target.transport.snapshots(destination)
+        # The catalog lists snapshots newest first.
+        listed = snapshots_for(source)
+        source_snapshots = set(listed)
+
+        # An absent destination directory lists no snapshots, which must not
+        # pass for a verified one.
+        problems = []
+        if listed and not received:
+            problems.append(f"Directory {destination} holds no snapshots.")
+        elif listed and listed[0] not in received:
+            problems.append(f"Latest snapshot {destination / listed[0]} is missing.")
+
+        for name, (received_uuid, read_only) in sorted(received.items()):
+            if received_uuid is None:
+                problems.append(f"Snapshot {destination / name} is incomplete.")
+            elif not read_only:
+                problems.append(f"Snapshot {destination / name} is not read-only.")
+            elif name in source_snapshots and send_uuid(source / name) != received_uuid:
+                problems.append(
+                    f"Snapshot {destination / name} does not match its source."
+                )
+
+        uploaded = load_upload_state(source.parent).get(target.id, {})
+        expected = uploaded.get(source.name)
+        if expected and expected not in received:
+            problems.append(
+                f"Snapshot {destination / expected} recorded as uploaded is missing."
+            )
+
+    return problems, received.keys() & source_snapshots
+
+
+def verify_directory(
+    source: Path,
+    targets: list[Target],
+    *,
+    content: bool,
+) -> list[str]:
+    problems: list[str] = []
+    received: set[str] = set()
+
+    for target in targets:
+        try:
+            found, names = verify_target(source, target)
+        except OSError as e:
+            problems.append(f"Verifying {source.name} on {target.id} failed: {e}")
+            continue
+        problems += found
+        received |= names
+
+    # Every target received the same stream, so each snapshot is sent only once.
+    if content:
+        for name in sorted(received):
+            try:
+                problem = check_content(source, name)
+            except OSError as e:
+                problem = str(e)
+            if problem:
+                problems.append(problem)
+
+    return problems
+
+
+def verify_directories(
+    directories: list[Path],
+    targets: list[Target],
+    *,
+    jobs: int,
+    content: bool,
+) -> bool:
+    """Verify every directory on every target, logging the problems found."""
+
+    def verify(directory: Path) -> list[str]:
+        with locks.hold(directory, exclusive=False) as held:
+            return verify_directory(directory, targets, content=content) if held else []
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = executor.map(verify, directories)
+        problems = [problem for result in results for problem in result]
+
+    for problem in problems:
+        logger.error(problem)
+
+    if problems:
+        logger.error("Verification found %d problems.", len(problems))
+        return False
+
+    logger.info(
+        "Verified %d directories on %d destinations.",
+        len(directories),
+        len(targets),
+    )
+
+    return True
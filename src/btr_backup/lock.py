@@ -0,0 +1,66 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+from fcntl import LOCK_EX, LOCK_NB, LOCK_SH, LOCK_UN, flock
+from pathlib import Path
+from time import monotonic, sleep
+
+from btr_backup.common import STATE_DIR
+from btr_backup.log import logger
+
+LOCK_DIR = "locks"
+LOCK_POLL_INTERVAL = 0.5
+
+
+class DirectoryLocks:
+    """Advisory locks that keep commands off logical directories in use.
+
+    Commands reading a directory hold a shared lock, commands changing it or
+    sending from it an exclusive one. The locks are flock(2) locks on a file
+    per directory in the state directory of the workdir, so they are released
+    when the process dies and work between threads of one process as well.
+    A busy directory is waited for up to wait seconds, forever when wait is
+    None, and then skipped.
+    """
+
+    def __init__(self) -> None:
+        self.wait: float | None = None
+
+    def path(self, directory: Path) -> Path:
+        return directory.parent / STATE_DIR / LOCK_DIR / f"{directory.name}.lock"
+
+    def acquire(self, fd: int, operation: int) -> bool:
+        if self.wait is None:
+            flock(fd, operation)
+            return True
+
+        deadline = monotonic() + self.wait
+        while True:
+            try:
+                flock(fd, operation | LOCK_NB)
+                return True
+            except BlockingIOError:
+                if monotonic() >= deadline:
+                    return False
+            sleep(LOCK_POLL_INTERVAL)
+
+    @contextmanager
+    def hold(self, directory: Path, *, exclusive: bool) -> Iterator[bool]:
+        """Lock a logical directory, yielding whether it was locked in time."""
+        path = self.path(directory)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        with path.open("a") as file:
+            if not self.acquire(file.fileno(), LOCK_EX if exclusive else LOCK_SH):
+                logger.warning(
+                    "%s is in use by another command, skipping.", directory.name
+                )
+                yield False
+                return
+
+            try:
+                yield True
+            finally:
+                flock(file.fileno(), LOCK_UN)
+
+
+locks = DirectoryLocks()
@@ -1,14 +1,83 @@
+import json
 import logging
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import UTC, datetime
+from enum import StrEnum
+from typing import Any
 
 logger = logging.getLogger("btr-backup")
+# Timing spans of command phases, shown with -vv or always in JSON logs.
+span_logger = logger.getChild("span")
 
+# Fields every JSON log line carries, null when they do not apply.
+FIELDS = ["command", "directory", "snapshot", "phase", "duration_ms", "bytes"]
 
-def setup_logger(logger: logging.Logger, *, verbosity: int) -> None:
+log_context: ContextVar[dict[str, Any]] = ContextVar("log_context", default={})
+
+
+class LogFormat(StrEnum):
+    text = "text"
+    json = "json"
+
+
+@contextmanager
+def log_fields(**fields: Any) -> Iterator[None]:
+    """Add fields to the records logged within, in this thread or task only."""
+    token = log_context.set(log_context.get() | fields)
+    try:
+        yield
+    finally:
+        log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    def __init__(self, command: str) -> None:
+        super().__init__()
+        self.command = command
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        fields = {"command": self.command} | log_context.get()
+        for name in FIELDS:
+            # Fields passed with extra= take precedence over the context.
+            if not hasattr(record, name):
+                setattr(record, name, fields.get(name))
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = {
+            "time": datetime.fromtimestamp(record.created, UTC).isoformat(),
+            "level": record.levelname.lower(),
+            "message": record.getMessage(),
+        }
+        line |= {name: getattr(record, name, None) for name in FIELDS}
+
+        if record.exc_info:
+            line["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(line, ensure_ascii=False)
+
+
+def setup_logger(
+    logger: logging.Logger,
+    *,
+    verbosity: int,
+    format: LogFormat = LogFormat.text,
+    command: str = "",
+) -> None:
     logger.setLevel(max(logging.WARNING - 10 * verbosity, logging.DEBUG))
 
     handler = logging.StreamHandler()
+    handler.addFilter(ContextFilter(command))
 
-    formatter = logging.Formatter(fmt="[%(levelname)s] %(message)s")
-    handler.setFormatter(formatter)
+    if format == LogFormat.json:
+        handler.setFormatter(JsonFormatter())
+        span_logger.setLevel(logging.DEBUG)
+    else:
+        formatter = logging.Formatter(fmt="[%(levelname)s] %(message)s")
+        handler.setFormatter(formatter)
 
     logger.addHandler(handler)
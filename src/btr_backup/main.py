@@ -1,13 +1,10 @@
 from argparse import ArgumentParser, Namespace
 from collections.abc import Sequence
-from contextlib import ExitStack
 from pathlib import Path
-from sys import exit
-from tempfile import TemporaryDirectory
 
-from btr_backup.commands import add_commands
-from btr_backup.common import block_device, mount_context
-from btr_backup.log import logger, setup_logger
+from btr_backup.commands import CommandParser, add_commands
+from btr_backup.common import block_device
+from btr_backup.log import LogFormat, logger, setup_logger
 
 
 def parse_args(args: Sequence[str] | None = None) -> Namespace:
@@ -25,6 +22,36 @@ def parse_args(args: Sequence[str] | None = None) -> Namespace:
         default=Path(),
         help="Directory on the btrfs disk/partition with subvolume structure.",
     )
+    parser.add_argument(
+        "--metrics-json",
+        type=Path,
+        help="Write per-phase timing and throughput metrics to this JSON file.",
+    )
+    parser.add_argument(
+        "--metrics-prometheus",
+        type=Path,
+        help="Write per-phase metrics to this Prometheus textfile collector file.",
+    )
+    parser.add_argument(
+        "--lock-wait",
+        type=float,
+        metavar="SECONDS",
+        help="Seconds to wait for a logical directory another command is using "
+        "before skipping it, waits as long as it takes by default.",
+    )
+    parser.add_argument(
+        "--log-format",
+        type=LogFormat,
+        choices=list(LogFormat),
+        default=LogFormat.text,
+        help="Log as text, or as JSON lines with command, directory, snapshot and "
+        "phase fields and a timing span for every phase.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        help="Write a cProfile dump of the run to this file, for pstats.",
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -33,7 +60,11 @@ def parse_args(args: Sequence[str] | None = None) -> Namespace:
         help="Enable verbose logging.",
     )
 
-    subparsers = parser.add_subparsers(required=True)
+    subparsers = parser.add_subparsers(
+        dest="command",
+        required=True,
+        parser_class=CommandParser,
+    )
     add_commands(subparsers)
 
     return parser.parse_args(args)
@@ -42,30 +73,17 @@ def parse_args(args: Sequence[str] | None = None) -> Namespace:
 def main() -> None:
     args = parse_args()
 
-    setup_logger(logger, verbosity=args.verbose)
+    setup_logger(
+        logger,
+        verbosity=args.verbose,
+        format=args.log_format,
+        command=args.command,
+    )
 
     logger.debug("Parsed arguments: %s", args)
 
-    with ExitStack() as stack:
-        temp_dir = stack.enter_context(TemporaryDirectory(prefix="btr-backup-"))
-
-        try:
-            mount_point = stack.enter_context(
-                mount_context(args.dev, temp_dir, "btrfs")
-            )
-        except OSError as e:
-            logger.error(
-                "Failed to mount %s device to %s: %s", args.dev, temp_dir, e.strerror
-            )
-            return
-
-        workdir = mount_point / args.chdir
-        if not workdir.exists():
-            logger.error(
-                "The specified working directory %s does not exist on the mounted device.",
-                args.chdir,
-            )
-            return
+    # Imported only once arguments are parsed, so that --help and usage errors
+    # do not load btrfsutil, mount and the rest of a mounted session.
+    from btr_backup.session import run_command
 
-        if not args.func(workdir, **vars(args)):
-            exit(1)
+    run_command(args)
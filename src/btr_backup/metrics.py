@@ -0,0 +1,200 @@
+import json
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Lock
+from time import perf_counter, time
+
+from btr_backup.common import write_atomic
+from btr_backup.log import log_fields, span_logger
+
+
+@dataclass
+class Measurement:
+    bytes: int = 0
+
+
+@dataclass
+class JobRun:
+    success: bool
+    timestamp: float
+
+
+@dataclass
+class Phase:
+    directory: str
+    name: str
+    duration: float = 0.0
+    bytes: int = 0
+    runs: int = 0
+
+    @property
+    def throughput(self) -> float:
+        return self.bytes / self.duration if self.duration else 0.0
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self.command = ""
+        self.success = False
+        self.phases: dict[tuple[str, str], Phase] = {}
+        # Outcome of the last run of each daemon job.
+        self.jobs: dict[str, JobRun] = {}
+        self.lock = Lock()
+
+    def record_job(self, name: str, success: bool) -> None:
+        with self.lock:
+            self.jobs[name] = JobRun(success, time())
+
+    def record(
+        self,
+        name: str,
+        directory: str = "",
+        *,
+        duration: float,
+        bytes: int = 0,
+    ) -> None:
+        with self.lock:
+            phase = self.phases.setdefault((directory, name), Phase(directory, name))
+            phase.duration += duration
+            phase.bytes += bytes
+            phase.runs += 1
+
+    @contextmanager
+    def measure(self, name: str, directory: str = "") -> Iterator[Measurement]:
+        """Time a phase, logging it as a span tagged on the records within."""
+        measurement = Measurement()
+        fields = {"phase": name} | ({"directory": directory} if directory else {})
+        start = perf_counter()
+        try:
+            with log_fields(**fields):
+                yield measurement
+        finally:
+            duration = perf_counter() - start
+            self.record(name, directory, duration=duration, bytes=measurement.bytes)
+
+            milliseconds = round(duration * 1000, 3)
+            span = {"duration_ms": milliseconds, "bytes": measurement.bytes}
+            span_logger.debug(
+                "Phase %s took %.1f ms.", name, milliseconds, extra=fields | span
+            )
+
+
+metrics = Metrics()
+
+
+def metrics_json(metrics: Metrics, timestamp: float) -> str:
+    return json.dumps(
+        {
+            "command": metrics.command,
+            "success": metrics.success,
+            "timestamp": timestamp,
+            "jobs": [
+                {"job": name, "success": run.success, "timestamp": run.timestamp}
+                for name, run in metrics.jobs.items()
+            ],
+            "phases": [
+                {
+                    "directory": phase.directory,
+                    "phase": phase.name,
+                    "runs": phase.runs,
+                    "duration_seconds": phase.duration,
+                    "bytes": phase.bytes,
+                    "mb_per_second": phase.throughput / 1e6,
+                }
+                for phase in metrics.phases.values()
+            ],
+        },
+        indent=2,
+    )
+
+
+def prometheus_labels(**labels: str) -> str:
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+    return ",".join(f'{name}="{value}"' for name, value in escaped)
+
+
+def metrics_prometheus(metrics: Metrics, timestamp: float) -> str:
+    run_labels = prometheus_labels(command=metrics.command)
+    lines = [
+        "# HELP btr_backup_last_run_timestamp_seconds Time the command finished.",
+        "# TYPE btr_backup_last_run_timestamp_seconds gauge",
+        f"btr_backup_last_run_timestamp_seconds{{{run_labels}}} {timestamp}",
+        "# HELP btr_backup_last_run_success Whether the command succeeded.",
+        "# TYPE btr_backup_last_run_success gauge",
+        f"btr_backup_last_run_success{{{run_labels}}} {int(metrics.success)}",
+    ]
+
+    if metrics.jobs:
+        job_labels = {
+            job: prometheus_labels(command=metrics.command, job=job)
+            for job in metrics.jobs
+        }
+        lines += [
+            "# HELP btr_backup_job_last_run_timestamp_seconds Time the job finished.",
+            "# TYPE btr_backup_job_last_run_timestamp_seconds gauge",
+            *(
+                f"btr_backup_job_last_run_timestamp_seconds{{{job_labels[job]}}} "
+                f"{run.timestamp}"
+                for job, run in metrics.jobs.items()
+            ),
+            "# HELP btr_backup_job_last_run_success Whether the job succeeded.",
+            "# TYPE btr_backup_job_last_run_success gauge",
+            *(
+                f"btr_backup_job_last_run_success{{{job_labels[job]}}} "
+                f"{int(run.success)}"
+                for job, run in metrics.jobs.items()
+            ),
+        ]
+
+    series = [
+        ("phase_runs", "Number of times the phase ran.", "runs"),
+        ("phase_duration_seconds", "Time spent in the phase.", "duration"),
+        ("phase_bytes", "Bytes moved during the phase.", "bytes"),
+        (
+            "phase_throughput_bytes_per_second",
+            "Bytes moved per second of the phase.",
+            "throughput",
+        ),
+    ]
+    for name, description, attribute in series:
+        lines.append(f"# HELP btr_backup_{name} {description}")
+        lines.append(f"# TYPE btr_backup_{name} gauge")
+        for phase in metrics.phases.values():
+            labels = prometheus_labels(
+                command=metrics.command,
+                directory=phase.directory,
+                phase=phase.name,
+            )
+            value = getattr(phase, attribute)
+            lines.append(f"btr_backup_{name}{{{labels}}} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def export_metrics(
+    metrics: Metrics,
+    *,
+    json_path: Path | None,
+    prometheus_path: Path | None,
+) -> None:
+    timestamp = time()
+
+    # Daemon jobs record metrics while others are exported.
+    with metrics.lock:
+        json_text = metrics_json(metrics, timestamp) if json_path else ""
+        prometheus_text = (
+            metrics_prometheus(metrics, timestamp) if prometheus_path else ""
+        )
+
+    # Both files are replaced atomically so that collectors never read a
+    # partially written file.
+    if json_path:
+        write_atomic(json_path, json_text.encode())
+
+    if prometheus_path:
+        write_atomic(prometheus_path, prometheus_text.encode())
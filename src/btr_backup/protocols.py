@@ -4,3 +4,11 @@ from typing import Any, Protocol
 
 class Subparsers(Protocol):
     def add_parser(self, name: str, *, help: str, **kwargs: Any) -> ArgumentParser: ...
+
+
+class Digest(Protocol):
+    """Running checksum like the hashlib ones."""
+
+    def update(self, data: bytes, /) -> None: ...
+
+    def hexdigest(self) -> str: ...
@@ -0,0 +1,72 @@
+from argparse import Namespace
+from collections.abc import Iterator
+from contextlib import ExitStack, contextmanager, suppress
+from cProfile import Profile
+from os import PathLike
+from pathlib import Path
+from sys import exit
+from tempfile import TemporaryDirectory
+
+from btr_backup.backend import backend
+from btr_backup.catalog import catalog_for
+from btr_backup.lock import locks
+from btr_backup.log import logger
+from btr_backup.metrics import export_metrics, metrics
+
+
+@contextmanager
+def mount_context(device: PathLike, destination: PathLike, fs: str) -> Iterator[Path]:
+    backend.mount(Path(device), Path(destination), fs)
+    try:
+        yield Path(destination)
+    finally:
+        with suppress(OSError):
+            backend.umount(Path(destination))
+
+
+def run_command(args: Namespace) -> None:
+    metrics.command = args.command
+    locks.wait = args.lock_wait
+
+    with ExitStack() as stack:
+        stack.callback(
+            export_metrics,
+            metrics,
+            json_path=args.metrics_json,
+            prometheus_path=args.metrics_prometheus,
+        )
+
+        if args.profile:
+            # Callbacks run in reverse, profiling stops before the dump.
+            profiler = Profile()
+            stack.callback(profiler.dump_stats, args.profile)
+            stack.callback(profiler.disable)
+            profiler.enable()
+
+        temp_dir = stack.enter_context(TemporaryDirectory(prefix="btr-backup-"))
+
+        try:
+            with metrics.measure("mount"):
+                mount_point = stack.enter_context(
+                    mount_context(args.dev, temp_dir, "btrfs")
+                )
+        except OSError as e:
+            logger.error(
+                "Failed to mount %s device to %s: %s", args.dev, temp_dir, e.strerror
+            )
+            return
+
+        workdir = mount_point / args.chdir
+        if not workdir.exists():
+            logger.error(
+                "The specified working directory %s does not exist on the mounted device.",
+                args.chdir,
+            )
+            return
+
+        stack.callback(catalog_for(workdir).save)
+
+        metrics.success = args.func(workdir, **vars(args))
+
+        if not metrics.success:
+            exit(1)
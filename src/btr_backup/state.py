@@ -0,0 +1,84 @@
+import json
+from pathlib import Path
+from threading import Lock
+from typing import TypedDict
+
+from btr_backup.common import STATE_DIR, write_atomic
+
+UPLOAD_STATE = "uploaded.json"
+STREAM_STATE = "streams"
+
+upload_state_lock = Lock()
+
+
+class StreamRecord(TypedDict):
+    parent: str | None
+    size: int
+    sha256: str
+
+
+def upload_state_path(workdir: Path) -> Path:
+    return workdir / STATE_DIR / UPLOAD_STATE
+
+
+def load_upload_state(workdir: Path) -> dict[str, dict[str, str]]:
+    """Newest snapshot of each logical directory shared with each destination."""
+    try:
+        return json.loads(upload_state_path(workdir).read_text())
+    except FileNotFoundError:
+        return {}
+
+
+def record_upload(
+    workdir: Path,
+    destination: str,
+    directory: str,
+    snapshot: str,
+) -> None:
+    path = upload_state_path(workdir)
+
+    with upload_state_lock:
+        state = load_upload_state(workdir)
+        if state.get(destination, {}).get(directory) == snapshot:
+            return
+
+        state.setdefault(destination, {})[directory] = snapshot
+
+        path.parent.mkdir(exist_ok=True)
+        write_atomic(path, json.dumps(state, indent=2).encode())
+
+
+def uploaded_snapshots(workdir: Path, directory: str) -> dict[str, str]:
+    """Map snapshots of a logical directory that must be kept to destinations."""
+    return {
+        directories[directory]: destination
+        for destination, directories in load_upload_state(workdir).items()
+        if directory in directories
+    }
+
+
+def stream_record_path(workdir: Path, directory: str, snapshot: str) -> Path:
+    return workdir / STATE_DIR / STREAM_STATE / directory / f"{snapshot}.json"
+
+
+def record_stream(
+    workdir: Path,
+    directory: str,
+    snapshot: str,
+    record: StreamRecord,
+) -> None:
+    """Remember the checksum of the send stream last uploaded for a snapshot."""
+    path = stream_record_path(workdir, directory, snapshot)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_atomic(path, json.dumps(record).encode())
+
+
+def forget_stream(workdir: Path, directory: str, snapshot: str) -> None:
+    stream_record_path(workdir, directory, snapshot).unlink(missing_ok=True)
+
+
+def load_stream(workdir: Path, directory: str, snapshot: str) -> StreamRecord | None:
+    try:
+        return json.loads(stream_record_path(workdir, directory, snapshot).read_text())
+    except FileNotFoundError:
+        return None
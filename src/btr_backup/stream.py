@@ -0,0 +1,214 @@
+from argparse import ArgumentTypeError
+from collections.abc import Callable
+from contextlib import suppress
+from errno import EINVAL
+from fcntl import F_SETPIPE_SZ, fcntl
+from os import read, splice, write
+from pathlib import Path
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+from time import monotonic, sleep
+
+from btr_backup.common import byte_size
+from btr_backup.log import logger
+from btr_backup.protocols import Digest
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+CONTROL_INTERVAL = 1.0
+# Chunks a fan-out sink may fall behind the source before the source waits.
+FANOUT_QUEUE_SIZE = 16
+DEFAULT_STALL_TIMEOUT = 60.0
+
+
+class Throttle:
+    """Token bucket limiting the bytes per second relayed by all uploads together.
+
+    Moved bytes are taken from the bucket after the fact and the caller sleeps
+    off any debt, so bursts are bounded by the buffer size. With a control
+    file the limit is re-read whenever the file changes, checked at most once
+    per CONTROL_INTERVAL, an empty file or 0 lifts the limit.
+    """
+
+    def __init__(self) -> None:
+        self.rate: int | None = None
+        self.control: Path | None = None
+        self.control_mtime: int | None = None
+        self.checked = 0.0
+        self.tokens = 0.0
+        self.updated = monotonic()
+        self.lock = Lock()
+
+    def configure(self, rate: int | None, control: Path | None) -> None:
+        with self.lock:
+            self.rate = rate or None
+            self.control = control
+            self.control_mtime = None
+            self.checked = 0.0
+
+    def reload(self, now: float) -> None:
+        if self.control is None or now - self.checked < CONTROL_INTERVAL:
+            return
+        self.checked = now
+
+        try:
+            mtime = self.control.stat().st_mtime_ns
+            if mtime == self.control_mtime:
+                return
+            self.control_mtime = mtime
+            text = self.control.read_text().strip()
+        except OSError:
+            return
+
+        try:
+            self.rate = byte_size(text) if text else None
+        except ArgumentTypeError as e:
+            logger.warning("Ignoring bandwidth limit in %s: %s", self.control, e)
+            return
+
+        logger.info("Bandwidth limit set to %s bytes per second.", self.rate or "no")
+
+    def consume(self, size: int) -> None:
+        with self.lock:
+            now = monotonic()
+            self.reload(now)
+
+            if not self.rate:
+                return
+
+            # At most a second worth of unused bandwidth is saved up.
+            elapsed = now - self.updated
+            self.tokens = min(self.tokens + elapsed * self.rate, self.rate) - size
+            self.updated = now
+            delay = -self.tokens / self.rate
+
+        if delay > 0:
+            sleep(delay)
+
+
+throttle = Throttle()
+
+
+def set_pipe_size(fd: int, size: int) -> None:
+    # Growing a pipe above /proc/sys/fs/pipe-max-size needs CAP_SYS_RESOURCE,
+    # the kernel default capacity is still a bounded buffer, so ignore failures.
+    with suppress(OSError):
+        fcntl(fd, F_SETPIPE_SZ, size)
+
+
+def write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[write(fd, view) :]
+
+
+def copy(
+    source: int,
+    sink: int,
+    buffer_size: int,
+    digest: Digest | None = None,
+) -> int:
+    total = 0
+    while chunk := read(source, buffer_size):
+        write_all(sink, chunk)
+        total += len(chunk)
+        throttle.consume(len(chunk))
+        if digest:
+            digest.update(chunk)
+    return total
+
+
+def relay(
+    source: int,
+    sink: int,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    digest: Digest | None = None,
+) -> int:
+    """Move all data from source to sink, returning the number of bytes moved.
+
+    Data is spliced between the descriptors without passing through user space
+    when one of them is a pipe, otherwise it falls back to a plain copy loop.
+    A digest fed with the data always needs the copy loop.
+    """
+    if digest:
+        return copy(source, sink, buffer_size, digest)
+
+    total = 0
+    try:
+        while moved := splice(source, sink, buffer_size):
+            total += moved
+            throttle.consume(moved)
+    except OSError as e:
+        if e.errno != EINVAL or total:
+            raise
+        return copy(source, sink, buffer_size)
+    return total
+
+
+def fan_out(
+    source: int,
+    sinks: list[int],
+    buffer_size: int,
+    *,
+    drop: Callable[[int], None],
+    stall_timeout: float = DEFAULT_STALL_TIMEOUT,
+    digest: Digest | None = None,
+) -> tuple[int, list[bool]]:
+    """Copy all data from source to every sink, reading the source once.
+
+    Each sink is written by its own thread from a bounded queue of chunks, so
+    a slow sink only holds the source back once its queue is full. A sink whose
+    queue stays full for stall_timeout seconds is given up and passed to drop,
+    which must make a pending write to it fail, as is one whose write fails.
+    The writer of a sink given up stops after its current write. Returns
+    the number of bytes read, also fed to digest if given, and whether each
+    sink received all of them.
+    """
+    queues: list[Queue[bytes | None]] = [Queue(FANOUT_QUEUE_SIZE) for _ in sinks]
+    alive = [True] * len(sinks)
+
+    def write(index: int) -> None:
+        while alive[index] and (chunk := queues[index].get()) is not None:
+            try:
+                write_all(sinks[index], chunk)
+            except OSError:
+                alive[index] = False
+                # Make room for a put that raced the failure, nothing follows.
+                with suppress(Empty):
+                    while True:
+                        queues[index].get_nowait()
+                return
+
+    def put(index: int, chunk: bytes | None) -> None:
+        try:
+            queues[index].put(chunk, timeout=stall_timeout)
+        except Full:
+            alive[index] = False
+            drop(index)
+            # Replace what the writer has yet to write with the end marker.
+            with suppress(Empty):
+                while True:
+                    queues[index].get_nowait()
+            queues[index].put_nowait(None)
+
+    writers = [Thread(target=write, args=(index,)) for index in range(len(sinks))]
+    for writer in writers:
+        writer.start()
+
+    total = 0
+    try:
+        while any(alive) and (chunk := read(source, buffer_size)):
+            total += len(chunk)
+            throttle.consume(len(chunk))
+            if digest:
+                digest.update(chunk)
+            for index in range(len(sinks)):
+                if alive[index]:
+                    put(index, chunk)
+    finally:
+        for index in range(len(sinks)):
+            if alive[index]:
+                put(index, None)
+        for writer in writers:
+            writer.join()
+
+    return total, alive
@@ -0,0 +1,323 @@
+import re
+import shlex
+from contextlib import suppress
+from dataclasses import dataclass
+from os import killpg
+from pathlib import Path, PurePosixPath
+from shutil import rmtree
+from signal import SIGKILL
+from subprocess import DEVNULL, PIPE, Popen, run
+from tempfile import mkdtemp
+from threading import Lock
+from typing import Protocol
+from uuid import UUID
+
+from btr_backup.backend import backend
+from btr_backup.btrfs import is_received, remove_partial, send_uuid
+from btr_backup.catalog import (
+    read_snapshot_info,
+    snapshot_added,
+    snapshots_for,
+)
+from btr_backup.common import STATE_DIR
+from btr_backup.log import logger
+
+# Compressing and decompressing shell commands of the wire compressions.
+COMPRESSORS = {
+    "zstd": ("zstd -c -T0", "zstd -dc"),
+    "gzip": ("gzip -c -1", "gzip -dc"),
+}
+
+LISTING_SEPARATOR = "--"
+# Seconds discard waits for a remote receive to notice its sender is gone.
+RECEIVE_EXIT_TIMEOUT = 60
+SUBVOLUME_LINE = re.compile(r"received_uuid (\S+) .*?path (.+)$")
+
+
+class Transport(Protocol):
+    """Destination filesystem that upload receives snapshots into."""
+
+    def prepare(self, destination: Path) -> None:
+        """Create the destination directory and remove partial snapshots in it."""
+        ...
+
+    def received_uuids(self, destination: Path) -> set[bytes]: ...
+
+    def snapshots(self, destination: Path) -> dict[str, tuple[bytes | None, bool]]:
+        """Received UUID and read-only flag of each snapshot in destination."""
+        ...
+
+    def reload(self) -> None:
+        """Forget destination listings cached so far."""
+        ...
+
+    def receive(self, destination: Path) -> Popen[bytes]: ...
+
+    def abort(self, receive: Popen[bytes]) -> None:
+        """Kill a receive and every process it started, waiting until they exit."""
+        ...
+
+    def received(self, subvol: Path) -> None: ...
+
+    def discard(self, subvol: Path) -> None:
+        """Remove a snapshot whose receive failed, if it was left behind."""
+        ...
+
+    def close(self) -> None: ...
+
+
+class LocalTransport:
+    """Destination on a filesystem mounted on this machine."""
+
+    def prepare(self, destination: Path) -> None:
+        destination.mkdir(exist_ok=True)
+
+        for name in snapshots_for(destination):
+            remove_partial(destination / name)
+
+    def received_uuids(self, destination: Path) -> set[bytes]:
+        if not destination.is_dir():
+            return set()
+
+        return {
+            send_uuid(destination / name)
+            for name in snapshots_for(destination)
+            if is_received(destination / name)
+        }
+
+    def snapshots(self, destination: Path) -> dict[str, tuple[bytes | None, bool]]:
+        if not destination.is_dir():
+            return {}
+
+        # Read afresh, the catalog trusts read-only snapshots to stay unchanged.
+        snapshots = {}
+        for name in snapshots_for(destination):
+            info = read_snapshot_info(destination / name)
+            received_uuid = info["received_uuid"]
+            snapshots[name] = (
+                bytes.fromhex(received_uuid) if received_uuid else None,
+                info["read_only"],
+            )
+        return snapshots
+
+    def reload(self) -> None:
+        # The catalog notices changes by itself.
+        pass
+
+    def receive(self, destination: Path) -> Popen[bytes]:
+        return backend.receive(destination)
+
+    def abort(self, receive: Popen[bytes]) -> None:
+        receive.kill()
+        receive.wait()
+
+    def received(self, subvol: Path) -> None:
+        snapshot_added(subvol)
+
+    def discard(self, subvol: Path) -> None:
+        remove_partial(subvol)
+
+    def close(self) -> None:
+        pass
+
+
+class CommandTransport:
+    """Destination reached by running shell commands through a command prefix.
+
+    The prefix is usually ssh, whose connection is then shared by every
+    command of the run through a control master. Other prefixes get the
+    commands as arguments of `sh -c`. Snapshots on the destination are listed
+    once, with paths relative to the top of its filesystem. The working
+    directory is resolved to such a path by the mount it is on, the mount
+    point and the subvolume mounted there, so that listed paths are matched
+    exactly whichever subvolume the destination mounts.
+
+    Receives run in a process group of their own, so that aborting one kills
+    the compressor and the prefix command along with it. The shell receiving
+    on the destination keeps its pid in the state directory while it runs,
+    for discard to wait until it noticed the end of its stream.
+    """
+
+    def __init__(
+        self,
+        command: list[str],
+        workdir: PurePosixPath,
+        *,
+        compress: str | None,
+    ) -> None:
+        self.workdir = workdir
+        self.compress = compress
+        self.control: Path | None = None
+        self.remote = command
+        self.prefix = command
+
+        if Path(command[0]).name == "ssh":
+            self.control = Path(mkdtemp(prefix="btr-backup-ssh-"))
+            self.prefix = [command[0], *self.ssh_options(), *command[1:]]
+
+        self.listing: dict[tuple[str, str], tuple[bytes | None, bool]] | None = None
+        self.lock = Lock()
+
+    def ssh_options(self) -> list[str]:
+        return [
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            f"ControlPath={self.control}/%C",
+            "-o",
+            "ControlPersist=yes",
+        ]
+
+    def command(self, script: str) -> list[str]:
+        if self.control:
+            return [*self.prefix, script]
+        return [*self.prefix, "sh", "-c", script]
+
+    def run(self, script: str) -> str:
+        command = self.command(script)
+        result = run(command, stdin=DEVNULL, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise OSError(result.stderr.strip() or f"{script} failed")
+        return result.stdout
+
+    def load_listing(self) -> dict[tuple[str, str], tuple[bytes | None, bool]]:
+        with self.lock:
+            if self.listing is None:
+                self.listing = self.list_snapshots()
+            return self.listing
+
+    def list_snapshots(self) -> dict[tuple[str, str], tuple[bytes | None, bool]]:
+        workdir = shlex.quote(str(self.workdir))
+        lines = self.run(
+            f"cd {workdir} && pwd -P && findmnt -n -o TARGET -T . && "
+            f"findmnt -n -o FSROOT -T . && echo {LISTING_SEPARATOR} && "
+            f"btrfs subvolume list -R . && echo {LISTING_SEPARATOR} && "
+            f"btrfs subvolume list -R -r ."
+        ).splitlines()
+
+        # Path of the working directory from the top of its filesystem, where
+        # the listed paths start.
+        directory, target, fsroot = (PurePosixPath(line.strip()) for line in lines[:3])
+        relative = (fsroot / directory.relative_to(target)).relative_to("/")
+
+        split = lines.index(LISTING_SEPARATOR, 4)
+        everything = filter(None, map(SUBVOLUME_LINE.search, lines[4:split]))
+        read_only = {
+            match[2]
+            for match in map(SUBVOLUME_LINE.search, lines[split + 1 :])
+            if match
+        }
+
+        listing = {}
+        for match in everything:
+            received_uuid, path = match.groups()
+            subvol = PurePosixPath(path)
+            if subvol.parent.parent == relative:
+                listing[subvol.parent.name, subvol.name] = (
+                    UUID(received_uuid).bytes if received_uuid != "-" else None,
+                    path in read_only,
+                )
+
+        logger.debug("Listed %d snapshots on destination.", len(listing))
+        return listing
+
+    def snapshots(self, destination: Path) -> dict[str, tuple[bytes | None, bool]]:
+        return {
+            name: details
+            for (directory, name), details in self.load_listing().items()
+            if directory == destination.name
+        }
+
+    def reload(self) -> None:
+        with self.lock:
+            self.listing = None
+
+    def prepare(self, destination: Path) -> None:
+        partial = [
+            destination / name
+            for name, (received_uuid, read_only) in self.snapshots(destination).items()
+            if received_uuid is None and not read_only
+        ]
+        for subvol in partial:
+            logger.warning("Removing partially received snapshot %s.", subvol)
+
+        state = destination.parent / STATE_DIR
+        script = shlex.join(["mkdir", "-p", str(destination), str(state)])
+        if partial:
+            delete = ["btrfs", "subvolume", "delete", *map(str, partial)]
+            script += " && " + shlex.join(delete)
+        self.run(script)
+
+    def received_uuids(self, destination: Path) -> set[bytes]:
+        return {
+            received_uuid
+            for received_uuid, read_only in self.snapshots(destination).values()
+            if received_uuid and read_only
+        }
+
+    def receive_pid(self, destination: Path) -> str:
+        path = destination.parent / STATE_DIR / f"{destination.name}.receive"
+        return shlex.quote(str(path))
+
+    def receive(self, destination: Path) -> Popen[bytes]:
+        receive = shlex.join(["btrfs", "receive", str(destination)])
+        compress = None
+        if self.compress is not None:
+            compress, decompress = COMPRESSORS[self.compress]
+            receive = f"{decompress} | {receive}"
+
+        pid = self.receive_pid(destination)
+        script = f"echo $$ > {pid}; {receive}; status=$?; rm -f {pid}; exit $status"
+        command = self.command(script)
+        if compress:
+            command = ["sh", "-c", f"{compress} | {shlex.join(command)}"]
+
+        return Popen(
+            command,
+            stdin=PIPE,
+            stdout=DEVNULL,
+            stderr=DEVNULL,
+            start_new_session=True,
+        )
+
+    def abort(self, receive: Popen[bytes]) -> None:
+        with suppress(ProcessLookupError):
+            killpg(receive.pid, SIGKILL)
+        receive.wait()
+
+    def received(self, subvol: Path) -> None:
+        pass
+
+    def discard(self, subvol: Path) -> None:
+        # Once the receive ended only a writable subvolume can be a partial one.
+        pid = self.receive_pid(subvol.parent)
+        path = shlex.quote(str(subvol))
+        try:
+            self.run(
+                f"pid=$(cat {pid} 2>/dev/null); i=0; "
+                f'while [ -n "$pid" ] && kill -0 "$pid" 2>/dev/null && '
+                f"[ $i -lt {RECEIVE_EXIT_TIMEOUT} ]; do sleep 1; i=$((i + 1)); done; "
+                f"if btrfs property get -ts {path} ro 2>/dev/null | grep -q false; "
+                f"then btrfs subvolume delete {path}; fi"
+            )
+        except OSError as e:
+            logger.warning("Failed to remove partial snapshot %s: %s", subvol, e)
+
+    def close(self) -> None:
+        if self.control is None:
+            return
+
+        # Options go before the host, after it they would be the remote command.
+        ssh, *arguments = self.remote
+        exit_command = [ssh, *self.ssh_options(), "-O", "exit", *arguments]
+        run(exit_command, stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL)
+        rmtree(self.control, ignore_errors=True)
+
+
+@dataclass(frozen=True)
+class Target:
+    """Destination directory of a btrfs upload and the transport reaching it."""
+
+    transport: Transport
+    workdir: Path
+    id: str